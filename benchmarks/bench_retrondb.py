@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the retrondb module, to compare how its functions scale with
+the size of the collection and to catch regressions between versions.
+
+Synthetic retron datasets shaped like ``demo_files/import-data-v1.csv`` are
+generated at each size, imported into a scratch database and then every
+public function is timed against it. Results are written as JSON.
+
+Never point this at the live retronDB: it drops and recreates its scratch
+databases. Use a local ``mongod`` (``--uri`` or RETRONDB_URI), ``--uri
+local`` for the in-memory backend of ``retrondb_local``, or ``--mongomock``
+for an in-process stand-in (pip install mongomock). Some aggregation and
+explain commands are not supported by the stand-ins and are recorded as
+errors.
+
+Usage: python benchmarks/bench_retrondb.py --uri mongodb://localhost:27017
+       python benchmarks/bench_retrondb.py --mongomock --sizes 1000 10000
+       python benchmarks/bench_retrondb.py --compare old.json new.json
+
+Created on Tue Oct 13 09:30:00 2026
+@author: alexpico
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import retrondb as rdb
+
+DEMO_FILE = os.path.join(REPO_DIR, "demo_files", "import-data-v1.csv")
+SIZES = [1000, 10000, 100000, 1000000]
+DB_PREFIX = "bench_retrondb_"
+
+
+###############################################################################
+# SYNTHETIC DATA
+def make_retrons(n=1000, seed=0, demo_file=DEMO_FILE):
+    """
+    Generate **n** synthetic retrons with the columns of the demo file.
+    Sequences are random with the lengths seen in the demo file, integer
+    properties are drawn from their observed ranges and other properties
+    from their observed values, each with the observed share of blanks.
+
+    Parameters
+    ----------
+    n : ``int``, optional
+        Number of retrons. Default is 1000.
+    seed : ``int``, optional
+        Random seed. Default is 0.
+    demo_file : ``str``, optional
+        CSV file to take the shape of the data from.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame of strings, with nodes "1" to **n**
+
+    """
+    rng = np.random.default_rng(seed)
+    demo_df = pd.read_csv(demo_file, dtype=str)
+    ret_df = pd.DataFrame({"node":np.arange(1, n + 1).astype(str)})
+
+    for col in demo_df.columns.drop("node"):
+        vals = demo_df[col]
+        blank = rng.random(n) < vals.isna().mean()
+        if col == "ncrna":
+            lengths = rng.choice(vals.dropna().str.len().to_numpy(), n)
+            ends = np.cumsum(lengths)
+            bases = np.frombuffer(b"ACGT", np.uint8)[
+                rng.integers(0, 4, ends[-1], dtype=np.uint8)].tobytes()
+            out = pd.Series([bases[e - l:e].decode()
+                             for e, l in zip(ends, lengths)])
+        elif rdb.PROPERTY_SCHEMA.get(col, {}).get('type') == "int":
+            nums = pd.to_numeric(vals, errors="coerce").dropna()
+            out = pd.Series(rng.integers(nums.min(), nums.max() + 1, n)
+                            .astype(str))
+        else:
+            out = pd.Series(rng.choice(vals.dropna().to_numpy(), n))
+        ret_df[col] = out.where(~blank)
+    return ret_df
+
+
+###############################################################################
+# TIMING
+def _timed(fn, repeat=1):
+    """
+    Run **fn** **repeat** times with its printing silenced. Returns the
+    seconds per run and the error, if any.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn()
+        except Exception as e:
+            return seconds, type(e).__name__ + ": " + str(e)[:200]
+        seconds.append(time.perf_counter() - start)
+    return seconds, None
+
+
+def bench_size(n=1000, workdir=None, repeat=3, only=None):
+    """
+    Import **n** synthetic retrons into a scratch database and time each
+    public function against it. Read-only functions are run **repeat**
+    times; functions that change the data are run once, in order.
+
+    Parameters
+    ----------
+    n : ``int``
+        Number of retrons
+    workdir : ``str``
+        Directory for the CSV and export files
+    repeat : ``int``, optional
+        Runs per read-only function. Default is 3.
+    only : ``list`` of ``str``, optional
+        Names of the functions to time. Default is all of them.
+
+    Returns
+    -------
+    list
+        A result ``dict`` per function
+
+    """
+    db_name = DB_PREFIX + str(n)
+    ret_df = make_retrons(n)
+    csv_file = os.path.join(workdir, "retrons-" + str(n) + ".csv")
+    ret_df.to_csv(csv_file, index=False)
+    upd_file = os.path.join(workdir, "update-" + str(n) + ".csv")
+    upd_df = ret_df.sample(frac=0.1, random_state=1)
+    upd_df = upd_df.assign(**{"bacterial editing":"50"})
+    upd_df.to_csv(upd_file, index=False)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rdb.connect_retronDB(db_name).database.client.drop_database(db_name)
+        rdb.connect_retronDB(db_name + "_restore").database.client \
+            .drop_database(db_name + "_restore")
+        rdb.clear_property_cache()
+        rdb._indexes_verified.clear()
+
+    state = {}
+    mid = str(n // 2)
+    some_nodes = [str(i) for i in range(1, n + 1, max(1, n // 100))]
+
+    def connect():
+        state['db'] = rdb.connect_retronDB(db_name)
+
+    # name, function, whether it only reads
+    steps = [
+        ("connect_retronDB", connect, True),
+        ("add_retrons_by_csv", lambda: rdb.add_retrons_by_csv(
+            state['db'], csv_file, new_property=True, chunksize=10000), False),
+        ("get_properties", lambda: rdb.get_properties(
+            state['db'], refresh=True), True),
+        ("get_all_retrons", lambda: rdb.get_all_retrons(state['db']), True),
+        ("get_all_retrons(dict)", lambda: rdb.get_all_retrons(
+            state['db'], format="dict"), True),
+        ("get_retron", lambda: rdb.get_retron(state['db'], mid), True),
+        ("get_retrons", lambda: rdb.get_retrons(state['db'], some_nodes),
+         True),
+        ("get_retrons_by", lambda: rdb.get_retrons_by(
+            state['db'], "retron (sub)b", "I-A"), True),
+        ("get_retrons_by(range)", lambda: rdb.get_retrons_by(
+            state['db'], "rt-dna production", {"$gt":50}), True),
+        ("iter_retrons", lambda: sum(len(b) for b in rdb.iter_retrons(
+            state['db'])), True),
+        ("summarize_retrons", lambda: rdb.summarize_retrons(state['db']),
+         True),
+        ("explain_query", lambda: rdb.explain_query(
+            state['db'], "msr/msd familiyc", "IX"), True),
+        ("build_kmer_index", lambda: rdb.build_kmer_index(state['db']),
+         False),
+        ("search_sequence", lambda: rdb.search_sequence(
+            state['db'], ret_df['ncrna'].dropna().iloc[0][20:60]), True),
+        ("add_retron", lambda: rdb.add_retron(
+            state['db'], {"node":str(n + 1), "rt/cladea":"1"}), False),
+        ("update_retron", lambda: rdb.update_retron(
+            state['db'], {"node":mid, "bacterial editing":"1"}), False),
+        ("update_retrons_by_csv", lambda: rdb.update_retrons_by_csv(
+            state['db'], upd_file), False),
+        ("update_retrons_by_csv(diff)", lambda: rdb.update_retrons_by_csv(
+            state['db'], upd_file, diff=True), False),
+        ("save_retronDB(csv)", lambda: rdb.save_retronDB(
+            state['db'], os.path.join(workdir, "save-" + str(n) + ".csv"),
+            overwrite=True), True),
+        ("save_retronDB(bson)", lambda: rdb.save_retronDB(
+            state['db'], os.path.join(workdir, "save-" + str(n) + ".bson"),
+            overwrite=True), True),
+        ("restore_retronDB", lambda: rdb.restore_retronDB(
+            os.path.join(workdir, "save-" + str(n) + ".bson"),
+            db_name + "_restore"), False),
+        ("backup_retronDB", lambda: rdb.backup_retronDB(
+            state['db'], os.path.join(workdir, "backup-" + str(n))), False),
+        ("remove_retron", lambda: rdb.remove_retron(state['db'], str(n + 1)),
+         False),
+        ("remove_retrons_by", lambda: rdb.remove_retrons_by(
+            state['db'], "msr/msd familiyc", "IX"), False),
+        ]
+
+    results = []
+    for name, fn, read_only in steps:
+        if only is not None and name.split("(")[0] not in only and \
+            name != "connect_retronDB" and name != "add_retrons_by_csv":
+            continue
+        seconds, error = _timed(fn, repeat if read_only else 1)
+        res = {"size":n, "function":name, "runs":len(seconds),
+               "seconds":seconds, "error":error}
+        if seconds:
+            res.update(min=min(seconds), median=statistics.median(seconds))
+        results.append(res)
+        print("  {:<30} {:>10}".format(name, "{:.4f}s".format(res['min'])
+                                        if seconds else "error"))
+        if error is not None:
+            print("    " + error)
+    return results
+
+
+def environment(backend=None):
+    """
+    Versions and settings the results were measured with.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=REPO_DIR, capture_output=True, text=True
+                                ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp":datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit":commit,
+            "backend":backend,
+            "python":platform.python_version(),
+            "pandas":pd.__version__,
+            "numpy":np.__version__,
+            "pymongo":rdb.pm.version,
+            "machine":platform.machine()}
+
+
+###############################################################################
+# COMPARISON
+def compare(old_file=None, new_file=None, threshold=1.2):
+    """
+    Print the ratio of new to old minimum times for each function and size
+    in two results files, flagging slowdowns beyond **threshold**. Returns
+    the number of regressions.
+    """
+    with open(old_file) as f:
+        old = {(r['size'], r['function']):r for r in json.load(f)['results']}
+    with open(new_file) as f:
+        new = {(r['size'], r['function']):r for r in json.load(f)['results']}
+
+    regressions = 0
+    print("{:>8} {:<30} {:>10} {:>10} {:>7}".format(
+        "size", "function", "old", "new", "ratio"))
+    for key in sorted(set(old) & set(new)):
+        o, m = old[key].get('min'), new[key].get('min')
+        if o is None or m is None:
+            continue
+        ratio = m / o if o > 0 else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = rdb.ansiRed.format("slower")
+            regressions += 1
+        print("{:>8} {:<30} {:>10.4f} {:>10.4f} {:>7.2f}{}".format(
+            key[0], key[1], o, m, ratio, flag))
+    return regressions
+
+
+###############################################################################
+# MAIN
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="numbers of retrons (default: %(default)s)")
+    parser.add_argument("--uri", help="MongoDB connection string of a " +
+                        "scratch server (default: RETRONDB_URI)")
+    parser.add_argument("--mongomock", action="store_true",
+                        help="use an in-process mongomock client")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per read-only function (default: 3)")
+    parser.add_argument("--only", nargs="+",
+                        help="names of the functions to time")
+    parser.add_argument("--output", default="bench_output.json",
+                        help="results file (default: %(default)s)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two results files instead")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare) > 0 else 0
+
+    if args.mongomock:
+        import mongomock
+        # Seed the pooled client that connect_retronDB() will reuse
+        os.environ['RETRONDB_URI'] = "mongodb://mongomock"
+        rdb._clients[("mongodb://mongomock", 100, 20000)] = \
+            mongomock.MongoClient()
+        backend = "mongomock " + mongomock.__version__
+    elif args.uri is not None:
+        os.environ['RETRONDB_URI'] = args.uri
+        backend = args.uri.split("@")[-1]
+    elif 'RETRONDB_URI' in os.environ:
+        backend = os.environ['RETRONDB_URI'].split("@")[-1]
+    else:
+        parser.error("a scratch server is required: use --uri, " +
+                     "RETRONDB_URI or --mongomock")
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            print("Benchmarking " + str(n) + " retrons")
+            results.extend(bench_size(n, workdir, args.repeat, args.only))
+
+    with open(args.output, "w") as f:
+        json.dump({"environment":environment(backend), "results":results},
+                  f, indent=1)
+    print("Wrote results to " + args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
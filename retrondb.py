@@ -10,25 +10,218 @@ Created on Mon Jul 25 09:58:00 2022
 @author: alexpico
 """
 
-import pymongo as pm
-from dotenv import load_dotenv
-from bson import json_util, son
 import re
-import pandas as pd
 import os
 import getpass
 import json
+import gzip
+import io
+import hashlib
+import importlib.util
+import itertools
+import datetime
+import math
+import threading
+import contextlib
+import contextvars
 import functools
+import time
+import sys
+import collections
+import copy
+
+
+class _LazyModule:
+    '''Stand-in for a module that is only imported when first used'''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Heavy dependencies are imported on the code paths that need them, so the
+# command line starts quickly (see main())
+pm = _LazyModule("pymongo")
+dotenv = _LazyModule("dotenv")
+bson = _LazyModule("bson")
+json_util = _LazyModule("bson.json_util")
+son = _LazyModule("bson.son")
+pd = _LazyModule("pandas")
+np = _LazyModule("numpy")
+futures = _LazyModule("concurrent.futures")
 
 #CONSTANTS
 ansiRed = "\033[91m {}\033[00m"
 ansiGreen = "\033[92m {}\033[00m"
 # ansiBlue = "\033[94m {}\033[00m"
 
+# Suffix of the side collection logging when each retron was last added, 
+# updated or removed (see sync_snapshot())
+CHANGES_SUFFIX = "_changes"
+# Suffix of the side collection archiving removed retrons (see 
+# restore_removed())
+TRASH_SUFFIX = "_trash"
+# Default directory for local snapshots of retron databases
+SNAPSHOT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "retrondb")
+# Overlap between incremental snapshot syncs, to tolerate in-flight writes
+SNAPSHOT_OVERLAP = datetime.timedelta(seconds=60)
+
+# Declared property types, applied to incoming retron data (see 
+# apply_schema()). Each type is "str", "int", "float" or "category" (with a 
+# list of allowed "categories"). Undeclared properties are stored as given.
+PROPERTY_SCHEMA = {
+    "node": {"type":"str", "nullable":False},
+    "rt-dna production": {"type":"int", "nullable":True},
+    "bacterial editing": {"type":"int", "nullable":True},
+    "mammalian editing group": {"type":"int", "nullable":True},
+    }
+
+# Declared indexes on the retrons collection (see ensure_indexes()). Each 
+# has a list of (property, direction) "keys" plus any ``create_index()`` 
+# options, e.g., "unique" or a "partialFilterExpression" to only index 
+# retrons with a value. Queries with comparison operators on a property 
+# imply it exists, so they can use the partial indexes.
+INDEX_SPEC = [
+    {"keys":[("node", 1)], "unique":True},
+    {"keys":[("retron (sub)b", 1)]},
+    {"keys":[("msr/msd familiyc", 1)]},
+    {"keys":[("rt/cladea", 1)]},
+    {"keys":[("retron (sub)b", 1), ("msr/msd familiyc", 1)]},
+    {"keys":[("rt-dna production", 1)], 
+     "partialFilterExpression":{"rt-dna production":{"$exists":True}}},
+    {"keys":[("bacterial editing", 1)], 
+     "partialFilterExpression":{"bacterial editing":{"$exists":True}}},
+    ]
+# Declared indexes on the change log and trash collections
+CHANGES_INDEX_SPEC = [
+    {"keys":[("node", 1)], "unique":True},
+    {"keys":[("modified", 1)]},
+    ]
+TRASH_INDEX_SPEC = [
+    {"keys":[("node", 1)]},
+    {"keys":[("removal", 1), ("removed", -1)]},
+    {"keys":[("removed", -1)]},
+    ]
+
+# Suffix of the side collection holding the k-mer index of ncRNA sequences 
+# (see build_kmer_index())
+KMERS_SUFFIX = "_kmers"
+# Seconds to trust that a collection has no k-mer index before looking again,
+# in case another process builds one
+KMER_RECHECK = 30
+# Nucleotides of each 2-bit code; anything else (e.g., N) is 4 and breaks 
+# k-mers (see _nt_codes())
+_NT_BASES = ["Aa", "Cc", "Gg", "TtUu"]
+
+#CACHES
+# Pooled MongoClients, keyed by URI and pool options (see connect_retronDB())
+_clients = {}
+# Collections whose INDEX_SPEC indexes have been confirmed
+_indexes_verified = set()
+# Property names per collection, keyed by ``_handle_key()``. Maintained by the
+# add/update functions and dropped by the remove functions. See
+# ``get_properties()`` and ``clear_property_cache()``.
+_property_catalog = {}
+# Collections whose change log indexes have been confirmed
+_changes_indexed = set()
+# Collections whose trash indexes have been confirmed
+_trash_indexed = set()
+# k of the k-mer index per collection, or None if there is no index, and 
+# when it was looked up (see _cached_kmer_k())
+_kmer_k = {}
+# Cached query results in least recently used order, keyed by collection, 
+# query and format (see enable_query_cache())
+_query_cache = collections.OrderedDict()
+# Query cache settings, hit/miss counts and a generation number bumped by 
+# every write, so results read before a write are not cached after it
+_query_cache_stats = {"max_size":0, "ttl":None, "hits":0, "misses":0,
+                      "evictions":0, "invalidations":0, "generation":0}
+_query_cache_lock = threading.Lock()
+# Reports of the active profile() blocks
+_profiles = []
+# Guards the reports, which are updated from any thread
+_profile_lock = threading.Lock()
+# Innermost profiled function running in this thread or task
+_profiled_call = contextvars.ContextVar("retrondb_profiled_call", 
+                                        default=None)
+
+
+###############################################################################
+# PROFILING
+def _profiled(fn):
+    """
+    Decorator recording the calls and seconds of a public function in the 
+    active ``profile()`` reports, and attributing the commands it sends to 
+    it. Does nothing but call the function when no profile is active.
+    """
+    name = fn.__name__
+    
+    if fn.__code__.co_flags & 0x20: # CO_GENERATOR
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            gen = fn(*args, **kwargs)
+            seconds = 0.0
+            try:
+                while True:
+                    token = _profiled_call.set(name)
+                    start = time.perf_counter()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        seconds += time.perf_counter() - start
+                        _profiled_call.reset(token)
+                    yield item
+            finally:
+                gen.close()
+                for report in _profiles:
+                    _profile_call(report, name, seconds)
+        return wrapper
+    
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _profiles:
+            return fn(*args, **kwargs)
+        token = _profiled_call.set(name)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            _profiled_call.reset(token)
+            for report in _profiles:
+                _profile_call(report, name, seconds)
+    return wrapper
+
+
+def _profile_entry(report=None, name=None):
+    """
+    The entry of a function in a ``profile()`` report, created if needed.
+    """
+    if name not in report:
+        report[name] = {"calls":0, "seconds":0.0, "commands":{}}
+    return report[name]
+
+
+def _profile_call(report=None, name=None, seconds=0.0):
+    """
+    Record a call of a profiled function in a ``profile()`` report.
+    """
+    with _profile_lock:
+        entry = _profile_entry(report, name)
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+
 
 ###############################################################################
 # GENERAL FUNCTIONS
-def connect_retronDB(db_name='retronDB'):
+@_profiled
+def connect_retronDB(db_name='retronDB', uri=None, max_pool_size=100,
+                     timeout_ms=20000):
     """
     A utility function to connect to the retron databases hosted by MongoDB 
     Atlas. This function will create a database if it does not already exist,
@@ -37,13 +230,29 @@ def connect_retronDB(db_name='retronDB'):
     convenient handle for other functions (e.g., **rdb_handle**). 
     
     Note that this function will also confirm (or create) a unique index on 
-    the "node" property to prevent duplicate records.
+    the "node" property to prevent duplicate records, as well as the other 
+    indexes declared in ``INDEX_SPEC`` (see ``ensure_indexes()``).
+    
+    Clients are pooled per process: connecting again, e.g., to another 
+    database on the same cluster, reuses the existing client and its 
+    connections, and the index is only confirmed once per database. See 
+    ``close_retronDB()``.
     
     Parameters
     ----------
     db_name : ``str``, optional
         Name of the database to connect to, e.g., 'sandbox'. Default is the
         official 'retronDB' database.
+    uri : ``str``, optional
+        A MongoDB connection string to use instead of the retronDB cluster, 
+        e.g., "mongodb://localhost:27017", or "local" for an in-memory 
+        database in this process (see ``retrondb_local``). Default is the 
+        RETRONDB_URI environment variable, if set.
+    max_pool_size : ``int``, optional
+        Maximum number of connections in the client's pool. Default is 100.
+    timeout_ms : ``int``, optional
+        Milliseconds to wait for a server or connection before giving up.
+        Default is 20000.
     
     Returns
     -------
@@ -53,26 +262,20 @@ def connect_retronDB(db_name='retronDB'):
     
     """
     
-    # Load config from a .env file or prompt for entries
-    load_dotenv(verbose=True)
-    try:
-        RETRONDB_USR = os.environ['RETRONDB_USR']
-    except KeyError:
-        RETRONDB_USR = input("Enter username:")
-    try:
-        RETRONDB_PWD = os.environ['RETRONDB_PWD']
-    except KeyError:
-        RETRONDB_PWD = getpass.getpass(prompt="Enter password:") 
-
-    # Construct MongoClient URI    
-    RETRONDB_URI = str("mongodb+srv://" +
-    RETRONDB_USR + ":" +
-    RETRONDB_PWD +
-    "@cluster0.uuutrha.mongodb.net/?retryWrites=true&w=majority")
+    uri = _retrondb_uri(uri)
 
-    # Connect to our MongoDB cluster
-    client = pm.MongoClient(RETRONDB_URI)
-    # print(client.database_names())
+    # Connect to our MongoDB cluster, reusing a pooled client if possible
+    client_key = (uri, max_pool_size, timeout_ms)
+    client = _clients.get(client_key)
+    if client is None and uri == "local":
+        client = importlib.import_module("retrondb_local").LocalClient()
+        _clients[client_key] = client
+    elif client is None:
+        client = pm.MongoClient(uri, maxPoolSize=max_pool_size,
+                                serverSelectionTimeoutMS=timeout_ms,
+                                connectTimeoutMS=timeout_ms,
+                                event_listeners=[_command_profiler()])
+        _clients[client_key] = client
 
     # Get the retronDB
     db = client[db_name]
@@ -83,26 +286,253 @@ def connect_retronDB(db_name='retronDB'):
               db_name + ". Check your username and password (or .env file).\n")
     else:
         print("\n" + ansiGreen.format("Success")+": Connected to "+
-              db_name + " with " + 
-              str(db['retrons'].count_documents({})) + 
+              db_name + " with about " + 
+              str(db['retrons'].estimated_document_count()) + 
               " retrons\n" )
-        # Confirm index on node; create if not
-        ind_set = False
-        for rdb_ind in list(db['retrons'].list_indexes()):
-            if son.SON(rdb_ind['key']).to_dict() == {'node':1}:
-                ind_set = True
-        if not ind_set:
-            db['retrons'].create_index("node", unique=True)
+        # Confirm indexes, once per process; create if not. Read-only users 
+        # cannot, so try again on the next connect.
+        if _handle_key(db['retrons']) not in _indexes_verified:
+            try:
+                ensure_indexes(db['retrons'])
+            except pm.errors.OperationFailure as e:
+                print(ansiRed.format("Warning")+": Could not confirm the" +
+                      " indexes of " + db_name + ".\n", e)
         # Return the retrons collection
         return db['retrons']
+
+
+@_profiled
+def ensure_indexes(rdb_handle=None, spec=None, drop=False):
+    """
+    Reconcile the indexes of a retron database with a declared list of 
+    indexes. Missing indexes are created in one call. Indexes with the same
+    keys but different options cannot be changed in place and are reported.
+    ``connect_retronDB()`` runs this once per database per process.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    spec : ``list`` of ``dict``, optional
+        Declared indexes. Default is ``INDEX_SPEC``.
+    drop : ``bool``, optional
+        Whether to also drop indexes that are not declared (other than 
+        "_id"). Default is ``False``.
+    
+    Returns
+    -------
+    list
+        Names of the created indexes
+    
+    """
+    ind_models, ind_extra = _index_plan(spec, rdb_handle.list_indexes())
+    ind_names = []
+    if len(ind_models) > 0:
+        ind_names = rdb_handle.create_indexes(ind_models)
+        print("Created indexes: " + ", ".join(ind_names))
+    
+    if drop:
+        for ind_name in ind_extra:
+            rdb_handle.drop_index(ind_name)
+            print("Dropped index: " + ind_name)
+    
+    _indexes_verified.add(_handle_key(rdb_handle))
+    return ind_names
+
+
+@_profiled
+def explain_query(rdb_handle=None, key="node", value=None):
+    """
+    Report how the database runs ``get_retrons_by()`` for a **key** and 
+    **value**: the plan stages, any indexes used, the number of index keys 
+    and retrons examined versus returned, and the execution time. A plan 
+    with a "COLLSCAN" stage reads every retron; consider declaring an index
+    on the key in ``INDEX_SPEC``.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    key : ``str``, optional
+        Property key or name, e.g., "genus"
+    value : ``str``, ``int``, ``float`` or ``set``
+        Propery value, e.g., "Escherichia" or set of conditions, e.g., {"$gt":5}
+    
+    Returns
+    -------
+    dict
+        Query plan and execution statistics
+    
+    """
+    if key == "node" and isinstance(value, int):
+        value = str(value)
+    value = _coerce_query_value(key, value)
+    rdb_filter = {str(key):value}
+    res = rdb_handle.database.command(
+        "explain", {"find":rdb_handle.name, "filter":rdb_filter},
+        verbosity="executionStats")
+    
+    # Walk the winning plan for its stages and indexes
+    plan_stages = []
+    plan_indexes = []
+    plan = [res['queryPlanner']['winningPlan']]
+    while len(plan) > 0:
+        stage = plan.pop()
+        stage = stage.get('queryPlan', stage)
+        plan_stages.append(stage.get('stage'))
+        if 'indexName' in stage:
+            plan_indexes.append(stage['indexName'])
+        plan.extend(stage.get('inputStages', []))
+        if 'inputStage' in stage:
+            plan.append(stage['inputStage'])
+    
+    exec_stats = res['executionStats']
+    report = {"filter":rdb_filter,
+              "stages":plan_stages,
+              "indexes":plan_indexes,
+              "collscan":"COLLSCAN" in plan_stages,
+              "keys_examined":exec_stats['totalKeysExamined'],
+              "docs_examined":exec_stats['totalDocsExamined'],
+              "returned":exec_stats['nReturned'],
+              "time_ms":exec_stats['executionTimeMillis']}
+    if report['collscan']:
+        print(ansiRed.format("CollectionScan")+": No index on \"" + 
+              str(key) + "\"; examined " + str(report['docs_examined']) +
+              " retrons to return " + str(report['returned']) + ".")
+    return report
+
+
+def close_retronDB():
+    """
+    Close all pooled clients opened by ``connect_retronDB()``. Handles 
+    returned previously should not be used afterwards. Call this in a child
+    process after forking, since clients cannot be shared across a fork.
+    
+    Returns
+    -------
+    None
+    
+    """
+    while len(_clients) > 0:
+        _, client = _clients.popitem()
+        client.close()
+    _indexes_verified.clear()
+    _changes_indexed.clear()
+    _trash_indexed.clear()
+
+
+@contextlib.contextmanager
+def profile():
+    """
+    Profile the retrondb functions called within a ``with`` block, e.g.,
+    ``with profile() as prof: get_all_retrons(dbr)``. For each function, 
+    the report counts its calls and seconds (including functions it calls)
+    and, per database command it sent, the number sent, their seconds on 
+    the server, retrons returned, and bytes sent and received. Commands are
+    credited to the innermost retrondb function that sent them. Nothing is
+    recorded outside of these blocks. See ``format_profile()``.
+    
+    Yields
+    ------
+    dict
+        Report, keyed by function name, filled in as the block runs
+
+    """
+    report = {}
+    _profiles.append(report)
+    try:
+        yield report
+    finally:
+        _profiles.remove(report)
+
+
+def format_profile(report=None, format="df"):
+    """
+    Format a report from ``profile()``.
+
+    Parameters
+    ----------
+    report : ``dict``
+        Report yielded by ``profile()``
+    format : ``str``, optional
+        Format of the report: "df", "json" or "prometheus" (text exposition
+        format, with counters named "retrondb_*"). Default is "df".
+    
+    Returns
+    -------
+    str or pandas.DataFrame
+        Report as a DataFrame with a row per function and command, JSON 
+        (str) or Prometheus text (str) depending on specified format
+    
+    """
+    format = format.lower()
+    if format not in ["df", "json", "prometheus"]:
+        raise ValueError ('format must be "df", "json" or "prometheus"')
+    if format == "json":
+        return json.dumps(report, indent=1)
+    
+    if format == "df":
+        rows = []
+        for name, entry in report.items():
+            cmds = entry['commands'] or {None:{}}
+            for cmd, stats in cmds.items():
+                rows.append({"function":name, "calls":entry['calls'], 
+                             "seconds":entry['seconds'], "command":cmd, 
+                             **stats})
+        return pd.DataFrame(rows, columns=[
+            "function", "calls", "seconds", "command", "count", 
+            "command_seconds", "failed", "retrons", "bytes_sent", 
+            "bytes_received"])
     
-def save_retronDB(rdb_handle=None, filename=None, overwrite=False):
+    lines = []
+    def metric(metric_name, help_text, samples):
+        lines.append("# HELP retrondb_" + metric_name + " " + help_text)
+        lines.append("# TYPE retrondb_" + metric_name + " counter")
+        for labels, value in samples:
+            lines.append("retrondb_" + metric_name + "{" + ",".join(
+                k + "=\"" + str(v).replace("\"", "\\\"") + "\"" 
+                for k, v in labels.items()) + "} " + str(value))
+    
+    metric("calls_total", "Calls of retrondb functions.",
+           [({"function":n}, e['calls']) for n, e in report.items()])
+    metric("call_seconds_total", "Seconds spent in retrondb functions.",
+           [({"function":n}, e['seconds']) for n, e in report.items()])
+    cmd_stats = [(n, c, st) for n, e in report.items() 
+                 for c, st in e['commands'].items()]
+    for stat, metric_name, help_text in [
+            ("count", "commands_total", "Database commands sent."),
+            ("command_seconds", "command_seconds_total", 
+             "Seconds of database commands."),
+            ("failed", "commands_failed_total", "Database commands failed."),
+            ("retrons", "retrons_returned_total", "Retrons returned."),
+            ("bytes_sent", "command_bytes_sent_total", 
+             "Bytes of database commands sent."),
+            ("bytes_received", "command_bytes_received_total", 
+             "Bytes of database replies received.")]:
+        metric(metric_name, help_text, 
+               [({"function":n, "command":c}, st[stat]) 
+                for n, c, st in cmd_stats])
+    return "\n".join(lines) + "\n"
+
+
+@_profiled
+def save_retronDB(rdb_handle=None, filename=None, overwrite=False, 
+                  format=None, compression=None, batch_size=1000):
     """
-    Save the entire retron database to a CSV file in your current working
+    Save the entire retron database to a file in your current working
     directory (See ``os.getcwd()``). Consider using ``os.chdir()`` to change the
     destination prior to running this function, or provide a full path as 
     the **filename** parameter.
     
+    Retrons are streamed from the database to the file in batches, so memory
+    use does not grow with the size of the database. Besides CSV, retrons 
+    can be saved as JSON Lines (extended JSON) or raw BSON, which keep value
+    types and "_id", or as Parquet. A manifest with the number of retrons and
+    a SHA-256 checksum is written next to the file, as 
+    ``<filename>.manifest.json``.
+    
     Also see ``restore_retronDB()`` to recreate a retron database from a saved 
     file.
 
@@ -114,9 +544,20 @@ def save_retronDB(rdb_handle=None, filename=None, overwrite=False):
     filename : ``str``
         Full path or path relavtive to current working directory, in addition 
         to the name of the file to be written. The ``.csv`` extension is 
-        automatically added is missing. 
+        automatically added is missing, unless the name ends with another 
+        known extension, e.g., ``.jsonl.gz``. 
     overwrite : ``bool``
         Whether to allow existing files to be overwritten. Default is False.
+    format : ``str``, optional
+        Either "csv", "jsonl", "parquet" or "bson". Default is based on the 
+        **filename** extension, or "csv".
+    compression : ``str``, optional
+        Either "gzip" or "zstd" (requires the ``zstandard`` package); for 
+        Parquet, any codec supported by ``pyarrow``, e.g., "snappy". Default
+        is based on the **filename** extension (``.gz`` or ``.zst``), or 
+        none.
+    batch_size : ``int``, optional
+        Number of retrons to write at a time. Default is 1000.
 
     Returns
     -------
@@ -124,31 +565,84 @@ def save_retronDB(rdb_handle=None, filename=None, overwrite=False):
         Path to saved retron database file.
 
     """
-    if re.search('.csv$', filename) is None: filename += '.csv'
+    format, compression = _export_format(filename, format, compression)
+    if format == "csv" and re.search(r'\.csv(\.gz|\.zst)?$', filename) is None: 
+        filename += '.csv'
     if os.path.exists(filename) and not overwrite:
         raise ProtectedFileError()
- 
-    rdb_df = get_all_retrons(rdb_handle)
-    rdb_df.to_csv(filename, index=False)
-    print("Saved retron database.")
+    
+    # Fixed columns for tabular formats; "_id" and "node" first. Not from 
+    # the cache, which misses properties added by other clients.
+    rdb_props = get_properties(rdb_handle, refresh=True)
+    rdb_cols = ["_id", "node"] + sorted(rdb_props - {"_id", "node"})
+    res = rdb_handle.find(batch_size=batch_size)
+    num_saved = 0
+    if format == "parquet":
+        pq = _require("pyarrow.parquet", 'format="parquet"')
+        pq_schema = _arrow_schema(rdb_cols)
+        with pq.ParquetWriter(filename, pq_schema, 
+                              compression=compression or "none") as f:
+            for batch in _cursor_batches(res, batch_size):
+                rdb_df = pd.DataFrame(batch).reindex(columns=rdb_cols)
+                f.write_table(_df_to_arrow(rdb_df, pq_schema))
+                num_saved += len(batch)
+    else:
+        with _open_export(filename, "wb", compression) as f:
+            for batch in _cursor_batches(res, batch_size):
+                if format == "csv":
+                    rdb_df = pd.DataFrame(batch).reindex(columns=rdb_cols)
+                    f.write(rdb_df.to_csv(index=False, header=num_saved == 0)
+                            .encode("utf-8"))
+                elif format == "jsonl":
+                    f.write("".join(json_util.dumps(r) + "\n" for r in batch)
+                            .encode("utf-8"))
+                else:
+                    f.write(b"".join(bson.encode(r) for r in batch))
+                num_saved += len(batch)
+            if format == "csv" and num_saved == 0:
+                f.write((",".join(rdb_cols) + "\n").encode("utf-8"))
+    
+    _write_json_atomic(filename + ".manifest.json", {
+        "filename":os.path.basename(filename),
+        "format":format,
+        "compression":compression,
+        "database":_handle_key(rdb_handle),
+        "created":datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "count":num_saved,
+        "properties":rdb_cols,
+        "sha256":_sha256_file(filename)})
+    print("Saved retron database (" + str(num_saved) + " retrons).")
     return os.path.abspath(filename)
     
     
-def restore_retronDB(filename=None, db_name=None):
+@_profiled
+def restore_retronDB(filename=None, db_name=None, batch_size=1000, uri=None):
     """
     This function will create a new retron database from a previously saved
-    CSV file. See ``save_retronDB()``. The returned pymongo.Collections obj is
+    file. See ``save_retronDB()``. The returned pymongo.Collections obj is
     the same type returned by ``connect_retronDB()`` and is ready to be used in
     subsequent functions.
+    
+    The file format is based on its extension. If a manifest was saved with 
+    the file, its checksum is verified first. Retrons from JSON Lines, BSON 
+    and Parquet files are inserted in batches, keeping their "_id". 
+    
+    If **filename** is a backup directory from ``backup_retronDB()``, its base
+    backup and each later delta are applied in order with bulk writes.
 
     Parameters
     ----------
     filename :  ``str``
         Full path or path relavtive to current working directory, in addition 
         to the name of the file to be read. The ``.csv`` extension is 
-        automatically added is missing. 
+        automatically added is missing. Or the path to a backup directory.
     db_name : ``str``
         Name of the database to create from file.
+    batch_size : ``int``, optional
+        Number of retrons to insert at a time. Default is 1000.
+    uri : ``str``, optional
+        A MongoDB connection string of the server to restore to, or "local".
+        See ``connect_retronDB()``.
 
     Returns
     -------
@@ -157,28 +651,298 @@ def restore_retronDB(filename=None, db_name=None):
         **rdb_handle** parameter in other functions.
 
     """
+    if os.path.isdir(filename):
+        return _restore_backup(filename, db_name, batch_size, uri)
+    
+    format, compression = _export_format(filename)
+    if format == "csv" and re.search(r'\.csv(\.gz|\.zst)?$', filename) is None: 
+        filename += '.csv'
+    
+    # check file against its manifest, if any
+    if os.path.exists(filename + ".manifest.json"):
+        with open(filename + ".manifest.json") as f:
+            rdb_manifest = json.load(f)
+        if _sha256_file(filename) != rdb_manifest['sha256']:
+            raise ValueError ("Checksum of " + filename + " does not match" +
+                              " its manifest. The file may be corrupt.")
+    
     # connect to new database instance
-    rdb_handle = connect_retronDB(db_name)
+    rdb_handle = connect_retronDB(db_name, uri)
     
     # load data
-    add_retrons_by_csv(rdb_handle,filename, True) 
+    if format == "csv":
+        add_retrons_by_csv(rdb_handle, filename, True)
+        return rdb_handle
+    num_restored = 0
+    for batch in _cursor_batches(_iter_export(filename, format, compression), 
+                                 batch_size):
+        try:
+            rdb_handle.insert_many(batch, ordered=False)
+        except pm.errors.BulkWriteError as e:
+            print(ansiRed.format("Error")+": Failed to restore " + 
+                  str(len(e.details['writeErrors'])) + " retrons, e.g.,\n", 
+                  e.details['writeErrors'][0]['errmsg'])
+            num_restored += e.details['nInserted']
+        else:
+            num_restored += len(batch)
+        _after_write(rdb_handle, [r['node'] for r in batch if 'node' in r],
+                     set().union(*(r.keys() for r in batch)))
+    print("Restored " + str(num_restored) + " retrons.")
     return rdb_handle
     
     
 
+@_profiled
+def backup_retronDB(rdb_handle=None, directory=None, full=False, 
+                    batch_size=1000):
+    """
+    Incrementally back up a retron database to a directory. The first backup
+    saves every retron (the base). Each later backup only saves retrons that 
+    were added or changed since the previous one (a delta), and lists the 
+    removed ones. A content hash of every retron is kept in the directory to
+    tell which retrons really changed. Use ``restore_retronDB()`` with the 
+    directory to apply the base and all deltas.
+    
+    By default, only retrons in the change log since the previous backup are 
+    checked, i.e., those changed by the functions in this module. Use 
+    **full** to check every retron, e.g., after other changes.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    directory : ``str``
+        Path to the backup directory. It is created if missing.
+    full : ``bool``, optional
+        Whether to check every retron for changes. Default is ``False``.
+    batch_size : ``int``, optional
+        Number of retrons to read at a time. Default is 1000.
+
+    Returns
+    -------
+    dict
+        The backup's entry in the directory manifest, e.g., with the number 
+        of saved and deleted retrons
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    bak_file = os.path.join(directory, "backup.json")
+    hash_file = os.path.join(directory, "hashes.json.gz")
+    bak_manifest = {"database":_handle_key(rdb_handle), "synced":None, 
+                    "chain":[]}
+    bak_hashes = {}
+    if os.path.exists(bak_file):
+        with open(bak_file) as f:
+            bak_manifest = json.load(f)
+        with gzip.open(hash_file, "rt") as f:
+            bak_hashes = json.load(f)
+    is_base = len(bak_manifest['chain']) == 0
+    
+    # Candidate retrons and the change log position to sync from next time
+    rdb_log = _changes_handle(rdb_handle)
+    last_log = rdb_log.find_one({}, sort=[("modified", -1)])
+    synced = None if last_log is None else last_log['modified']
+    if is_base or full or bak_manifest['synced'] is None:
+        bak_filter = {}
+        bak_deleted = set(bak_hashes)
+    else:
+        since = datetime.datetime.fromisoformat(bak_manifest['synced'])
+        bak_log = list(rdb_log.find(
+            {"modified":{"$gte":since - SNAPSHOT_OVERLAP}}))
+        bak_filter = {"node":{"$in":[l['node'] for l in bak_log 
+                                     if not l['deleted']]}}
+        bak_deleted = set(l['node'] for l in bak_log if l['deleted'])
+    
+    # Save retrons whose content hash changed
+    bak_name = "{:04d}-{}-{}.bson.gz".format(
+        len(bak_manifest['chain']), "base" if is_base else "delta",
+        datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S"))
+    num_saved = 0
+    with _open_export(os.path.join(directory, bak_name), "wb", "gzip") as f:
+        res = rdb_handle.find(bak_filter, batch_size=batch_size)
+        for batch in _cursor_batches(res, batch_size):
+            for r in batch:
+                bak_deleted.discard(r['node'])
+                r_hash = _retron_hash(r)
+                if bak_hashes.get(r['node']) != r_hash:
+                    bak_hashes[r['node']] = r_hash
+                    f.write(bson.encode(r))
+                    num_saved += 1
+    bak_deleted = sorted(n for n in bak_deleted if n in bak_hashes)
+    for n in bak_deleted:
+        del bak_hashes[n]
+    
+    if is_base or num_saved > 0 or len(bak_deleted) > 0:
+        bak_entry = {"file":bak_name, "type":"base" if is_base else "delta",
+                     "created":datetime.datetime.now(datetime.timezone.utc)
+                     .isoformat(),
+                     "count":num_saved, "deleted":bak_deleted,
+                     "sha256":_sha256_file(os.path.join(directory, bak_name))}
+        bak_manifest['chain'].append(bak_entry)
+        print("Backed up " + str(num_saved) + " retrons and " + 
+              str(len(bak_deleted)) + " removals as " + bak_name + ".")
+    else:
+        os.remove(os.path.join(directory, bak_name))
+        bak_entry = {"file":None, "type":"none", "count":0, "deleted":[]}
+        print("No changes since the previous backup.")
+    
+    # Manifest first, so the hashes never run ahead of the chain: after a 
+    # crash in between, the next delta saves the same changes again
+    with gzip.open(hash_file + ".tmp", "wt") as f:
+        json.dump(bak_hashes, f)
+    bak_manifest['synced'] = None if synced is None else synced.isoformat()
+    _write_json_atomic(bak_file, bak_manifest)
+    os.replace(hash_file + ".tmp", hash_file)
+    return bak_entry
+
+
+@_profiled
+def sync_retronDB(source_handle=None, target_handle=None, mirror=False,
+                  batch_size=1000, partitions=8, max_workers=4, indexes=True):
+    """
+    Copy the retrons of one retron database into another, e.g., to refresh
+    the sandbox database from retronDB, or between the retronDB cluster and
+    a local database (see ``connect_retronDB()``). 
+    
+    The source is split into ranges of node IDs that are copied in parallel.
+    Retrons are upserted with their "_id" in bulk writes, so property types 
+    and "_id"s are kept, e.g., for ``restore_removed()`` and backups of the 
+    target. Retrons already in the target are replaced, including any with 
+    the same node ID but another "_id". Properties are not checked, since 
+    they come from another retron database. The index definitions of the 
+    source are created in the target, too.
+
+    Parameters
+    ----------
+    source_handle : ``pymongo.Collection`` obj
+        The retron database collection to copy from
+    target_handle : ``pymongo.Collection`` obj
+        The retron database collection to copy to
+    mirror : ``bool``, optional
+        Whether to also remove retrons that are not in the source from the
+        target (see ``restore_removed()``). Default is ``False``.
+    batch_size : ``int``, optional
+        Number of retrons per bulk write. Default is 1000.
+    partitions : ``int``, optional
+        Maximum number of node ID ranges. Default is 8.
+    max_workers : ``int``, optional
+        Maximum number of ranges to copy at once. Default is 4.
+    indexes : ``bool``, optional
+        Whether to copy the index definitions. Default is ``True``.
+    
+    Returns
+    -------
+    dict
+        Numbers of retrons "copied" and "removed", the number of 
+        "partitions" and the names of the "indexes" created
+
+    """
+    # Copy indexes first, so the target enforces unique node IDs
+    sync_inds = []
+    if indexes:
+        sync_spec = [{"keys":list(ind['key'].items()), 
+                      **{o:v for o, v in ind.items() if o in 
+                         ["name", "unique", "sparse", 
+                          "partialFilterExpression", "collation"]}}
+                     for ind in source_handle.list_indexes() 
+                     if ind['name'] != "_id_"]
+        sync_inds = ensure_indexes(target_handle, sync_spec)
+    
+    # Node ID ranges of about the same number of retrons
+    sync_nodes = [r['node'] for r in source_handle.find(
+        {}, {"_id":0, "node":1}, sort=[("node", 1)], batch_size=10000)]
+    num_parts = max(1, min(partitions, -(-len(sync_nodes) // batch_size)))
+    bounds = [sync_nodes[len(sync_nodes) * i // num_parts] 
+              for i in range(1, num_parts)]
+    ranges = list(zip([None] + bounds, bounds + [None]))
+    
+    sync_call = _profiled_call.get()
+    def copy_range(node_range):
+        _profiled_call.set(sync_call)
+        lo, hi = node_range
+        node_cond = {}
+        if lo is not None:
+            node_cond['$gte'] = lo
+        if hi is not None:
+            node_cond['$lt'] = hi
+        res = source_handle.find({"node":node_cond} if node_cond else {}, 
+                                 batch_size=batch_size)
+        num_copied = 0
+        for batch in _cursor_batches(res, batch_size):
+            # Target retrons of these nodes under another _id give way
+            target_handle.delete_many(
+                {"node":{"$in":[r['node'] for r in batch]},
+                 "_id":{"$nin":[r['_id'] for r in batch]}})
+            target_handle.bulk_write([pm.ReplaceOne({"_id":r['_id']}, r, 
+                                                    upsert=True) 
+                                      for r in batch], ordered=False)
+            _after_write(target_handle, [r['node'] for r in batch], 
+                         set().union(*batch) | {"_id"})
+            num_copied += len(batch)
+        return num_copied
+    
+    with futures.ThreadPoolExecutor(max_workers) as pool:
+        num_copied = sum(pool.map(copy_range, ranges))
+    
+    num_removed = 0
+    if mirror:
+        sync_set = set(sync_nodes)
+        sync_extra = [r['node'] for r in target_handle.find(
+            {}, {"_id":0, "node":1}) if r['node'] not in sync_set]
+        if len(sync_extra) > 0:
+            num_removed = len(_remove_retrons(
+                target_handle, {"node":{"$in":sync_extra}}, batch_size))
+    
+    print("Synced retrons: " + str(num_copied) + " copied in " + 
+          str(len(ranges)) + " partitions, " + str(num_removed) + 
+          " removed.")
+    return {"copied":num_copied, "removed":num_removed, 
+            "partitions":len(ranges), "indexes":sync_inds}
+
+
 ###############################################################################
 # GET FUNCTIONS
-def get_all_retrons(rdb_handle=None, format="df"):
+@_profiled
+def get_all_retrons(rdb_handle=None, format="df", source="db", fields=None,
+                    exclude=None, sort=None, limit=None, after=None):
     """
     Returns a ``pandas.DataFrame`` of all fields (columns) for all retrons (rows).
 
+    For large databases, consider ``iter_retrons()`` to process retrons in
+    batches with bounded memory, or **source**="cache" to read from a local 
+    snapshot that is synced incrementally (see ``sync_snapshot()``).
+    
+    Use **fields** or **exclude** to only transfer the properties you need,
+    and **limit** with **after** to page through retrons by node ID.
+
     Parameters
     ----------
     rdb_handle : ``pymongo.Collection`` obj
         A retron database collection object, e.g., the output of 
         ``get_retronDB()``
     format : ``str``, optional
-        Either "raw", "json", "dict", or "df" (default)
+        Either "raw", "json", "dict", or "df" (default). Only "df" is 
+        available from the cache.
+    source : ``str``, optional
+        Either "db" (default) to query the database or "cache" to sync and 
+        read a local snapshot. Only **fields** and **exclude** are available
+        from the cache.
+    fields : ``list`` of ``str``, optional
+        Properties to return, e.g., ["node","msr/msd familiyc"]. "_id" is 
+        only returned if listed. Default is all properties.
+    exclude : ``list`` of ``str``, optional
+        Properties to leave out, e.g., ["ncrna"]. Cannot be combined with 
+        **fields**.
+    sort : ``str`` or ``list`` of ``str``, optional
+        Properties to sort by, each prefixed with "-" for descending order,
+        e.g., ["msr/msd familiyc", "-node"].
+    limit : ``int``, optional
+        Maximum number of retrons to return. Default is no limit.
+    after : ``str``, optional
+        Only return retrons with a node ID greater than this one, sorted by
+        node ID. Pass the last node ID of one page to get the next page. 
+        Node IDs are compared as strings, e.g., "10" comes before "9".
     
     Returns
     -------
@@ -187,11 +951,36 @@ def get_all_retrons(rdb_handle=None, format="df"):
         depending on specified format
     
     """               
-    res = rdb_handle.find()
-    return format_result(res, format)
+    if source not in ["db", "cache"]:
+        raise ValueError ('source must be "db" or "cache"')
+    if source == "cache":
+        if format.lower() != "df":
+            raise ValueError ('format must be "df" when source is "cache"')
+        if sort is not None or limit is not None or after is not None:
+            raise ValueError ('sort, limit and after are not available when' +
+                              ' source is "cache"')
+        snap_df = sync_snapshot(rdb_handle)
+        if fields is not None:
+            snap_df = snap_df[[f for f in fields if f in snap_df]]
+        if exclude is not None:
+            snap_df = snap_df.drop(columns=exclude, errors="ignore")
+        return snap_df
     
+    if format.lower() == "raw":
+        return rdb_handle.find(**_find_args(None, fields, exclude, sort, 
+                                            limit, after))
+    def run():
+        res = iter_retrons(rdb_handle, None, format=format, fields=fields, 
+                           exclude=exclude, sort=sort, limit=limit, 
+                           after=after)
+        return _collect_batches(res, format)
+    return _cached_query(rdb_handle, {"get_all_retrons":_find_args(
+        None, fields, exclude, sort, limit, after)}, format, run)
     
-def get_retron(rdb_handle=None, node=None, format="df"):
+    
+@_profiled
+def get_retron(rdb_handle=None, node=None, format="df", fields=None, 
+               exclude=None):
     """
     Returns a single retron as either a JSON string, Python dictionary or 
     Pandas DataFrame (default).
@@ -205,6 +994,12 @@ def get_retron(rdb_handle=None, node=None, format="df"):
         Unique retron node ID 
     format : ``str``, optional
         Either "raw", "json", "dict", or "df" (default)
+    fields : ``list`` of ``str``, optional
+        Properties to return, e.g., ["node","msr/msd familiyc"]. "_id" is 
+        only returned if listed. Default is all properties.
+    exclude : ``list`` of ``str``, optional
+        Properties to leave out, e.g., ["ncrna"]. Cannot be combined with 
+        **fields**.
     
     Returns
     -------
@@ -213,11 +1008,18 @@ def get_retron(rdb_handle=None, node=None, format="df"):
         depending on specified format
     
     """
-    res = rdb_handle.find_one({"node":str(node)})
-    return format_result(res, format)
+    find_args = _find_args({"node":str(node)}, fields, exclude)
+    if format.lower() == "raw":
+        return rdb_handle.find_one(**find_args)
+    return _cached_query(rdb_handle, {"find_one":find_args}, format, 
+                         lambda: format_result(rdb_handle.find_one(**find_args),
+                                               format))
 
     
-def get_retrons_by(rdb_handle=None, key="node", value=None, format="df"):
+@_profiled
+def get_retrons_by(rdb_handle=None, key="node", value=None, format="df",
+                   fields=None, exclude=None, sort=None, limit=None, 
+                   after=None):
     """
     Returns one or more retrons by a particular **key** and **value**. The default
     key is "node". Value can be a set of conditions using MongoDB query
@@ -230,6 +1032,9 @@ def get_retrons_by(rdb_handle=None, key="node", value=None, format="df"):
     * $in - Matches any of the values specified in an array. Sensitive to type.
     * $nin - Matches none of the values specified in an array. Sensitive to type.
     
+    Values for declared numeric properties (see ``PROPERTY_SCHEMA``) are 
+    converted to numbers, e.g., {"$gt":"50"} becomes {"$gt":50}.
+    
     Parameters
     ----------
     rdb_handle : ``pymongo.Collection`` obj
@@ -241,6 +1046,21 @@ def get_retrons_by(rdb_handle=None, key="node", value=None, format="df"):
         Propery value, e.g., "Escherichia" or set of conditions, e.g., {"$gt":5}
     format : ``str``, optional
         Either "raw", "json", "dict", or "df" (default)
+    fields : ``list`` of ``str``, optional
+        Properties to return, e.g., ["node","msr/msd familiyc"]. "_id" is 
+        only returned if listed. Default is all properties.
+    exclude : ``list`` of ``str``, optional
+        Properties to leave out, e.g., ["ncrna"]. Cannot be combined with 
+        **fields**.
+    sort : ``str`` or ``list`` of ``str``, optional
+        Properties to sort by, each prefixed with "-" for descending order,
+        e.g., ["msr/msd familiyc", "-node"].
+    limit : ``int``, optional
+        Maximum number of retrons to return. Default is no limit.
+    after : ``str``, optional
+        Only return retrons with a node ID greater than this one, sorted by
+        node ID. Pass the last node ID of one page to get the next page. 
+        Node IDs are compared as strings, e.g., "10" comes before "9".
     
     Returns
     -------
@@ -256,103 +1076,595 @@ def get_retrons_by(rdb_handle=None, key="node", value=None, format="df"):
         
     if key == "node" and isinstance(value, int):
         value = str(value)
+    value = _coerce_query_value(key, value)
         
-    res = rdb_handle.find({str(key):value})
-    return format_result(res, format)
+    if format.lower() == "raw":
+        return rdb_handle.find(**_find_args({str(key):value}, fields, exclude,
+                                            sort, limit, after))
+    def run():
+        res = iter_retrons(rdb_handle, {str(key):value}, format=format, 
+                           fields=fields, exclude=exclude, sort=sort, 
+                           limit=limit, after=after)
+        return _collect_batches(res, format)
+    return _cached_query(rdb_handle, {"get_retrons_by":_find_args(
+        {str(key):value}, fields, exclude, sort, limit, after)}, format, run)
 
 
-###############################################################################
-# ADD FUNCTIONS
-def add_retron(rdb_handle=None, retron_dict=None, new_property=False):
+@_profiled
+def get_retrons(rdb_handle=None, nodes=None, format="df", fields=None,
+                exclude=None, chunk_size=1000, max_workers=4):
     """
-    Add a single retron given a dictionary. The ``dict`` must include a unique
-    identifier key called "node" with a string-encoded integer, e.g., "node":"0".
-    
-    All properties will be checked against current database properties. By 
-    default, unrecognized properties will be rejected (see **new_property** parameter).
+    Returns retrons for a list of node IDs, in the order given. Node IDs are
+    converted to strings, and large lists are split into chunks that are 
+    queried in parallel with "$in". Requested nodes that are not in the 
+    database are reported, and listed as ``attrs['missing']`` of the 
+    DataFrame format.
 
     Parameters
     ----------
     rdb_handle : ``pymongo.Collection`` obj
         A retron database collection object, e.g., the output of 
         ``get_retronDB()``
-    retron_dict : ``dict``
-        A dictionary with retron data
-    new_property : ``bool``, optional
-        Whether to accept novel properties. Default is ``False``.
-
+    nodes : ``list`` of ``str`` or ``int``
+        Retron node IDs, e.g., ["1","28","64"]
+    format : ``str``, optional
+        Either "json", "dict", or "df" (default)
+    fields : ``list`` of ``str``, optional
+        Properties to return, e.g., ["node","msr/msd familiyc"]. "node" is 
+        always returned and "_id" only if listed. Default is all properties.
+    exclude : ``list`` of ``str``, optional
+        Properties to leave out, e.g., ["ncrna"]. Cannot be combined with 
+        **fields**.
+    chunk_size : ``int``, optional
+        Maximum number of node IDs per query. Default is 1000.
+    max_workers : ``int``, optional
+        Maximum number of queries to run at once. Default is 4.
+    
     Returns
     -------
-    pandas.DataFrame 
-        DataFrame of added retron properties.
-
+    str, dict, or pandas.DataFrame
+        Retron properties as JSON (str), dictionary or DataFrame depending on
+        specified format
+    
     """
-    radd_props = set(retron_dict.keys())
-    if "node" not in radd_props:
-        # SKIP: assigning new node ID if missing; might be too dangerous?
-        # res = rdb_handle.find().sort("node", -1)
-        # max_node = format_result(res[0], "df")['node'][0]
-        # retron_dict['node'] = str(int(max_node) +1)
-        # print("Assigning unique node ID...\n")
-        raise MissingKeyError()
-    else:
-        # force string values for node IDs
-        retron_dict['node'] = str(retron_dict['node'])
-        # "node" is indexed so, duplicates will be caught automatically
-       
-    check_new_property(rdb_handle, radd_props, new_property)
+    if format.lower() not in ["json","dict","df"]:
+        raise ValueError ('format must be "json", "dict" or "df"')
     
-    try:
-        radd_obj = rdb_handle.insert_one(retron_dict)
-    except pm.errors.DuplicateKeyError:
-        print(ansiRed.format("DuplicateKeyError")+": \"" +
-          retron_dict['node'] + "\" A retron with this" +
-              " same node ID already exists in the database. Either" +
-              " change the node ID"+
-              " or consider using update_retron().")
-    except Exception as e:
-        print(ansiRed.format("Error")+": Failed to add retron.\n", e)
-    else:
-        radd_id = radd_obj.inserted_id
-        print("Added retron to the database.")
-        radd_res = rdb_handle.find_one({"_id":radd_id})
-        return format_result(radd_res)
-        
+    # Unique node IDs as strings, in input order
+    rget_nodes = list(dict.fromkeys(str(n) for n in nodes))
+    
+    if fields is not None:
+        fields = ["node"] + [f for f in fields if f != "node"]
+    if exclude is not None:
+        exclude = [e for e in exclude if e != "node"]
+    
+    cache_args = {"get_retrons":_find_args({"node":{"$in":rget_nodes}}, 
+                                           fields, exclude)}
+    return _cached_query(rdb_handle, cache_args, format, lambda: 
+                         _get_retrons(rdb_handle, rget_nodes, format, fields,
+                                      exclude, chunk_size, max_workers))
 
 
-def add_retrons_by_csv(rdb_handle=None, filename=None, new_property=False):
+def _get_retrons(rdb_handle=None, rget_nodes=None, format="df", fields=None,
+                 exclude=None, chunk_size=1000, max_workers=4):
     """
-    Add one or more retrons given a CSV file. There must be
-    a unique integer identifier for each row in a column named "node".
+    Query retrons for unique node IDs in parallel chunks. See 
+    ``get_retrons()``.
+    """
+    rget_chunks = list(_cursor_batches(iter(rget_nodes), chunk_size))
+    rget_call = _profiled_call.get()
+    def find_chunk(chunk):
+        _profiled_call.set(rget_call)
+        return list(rdb_handle.find(**_find_args({"node":{"$in":chunk}}, 
+                                                 fields, exclude)))
     
-    All properties will be checked against current database properties. By 
-    default, unrecognized properties will be rejected (see **new_property** parameter).
+    rget_docs = {}
+    with futures.ThreadPoolExecutor(max_workers) as pool:
+        for res in pool.map(find_chunk, rget_chunks):
+            rget_docs.update((r['node'], r) for r in res)
+    
+    rget_missing = [n for n in rget_nodes if n not in rget_docs]
+    if len(rget_missing) > 0:
+        print(ansiRed.format("MissingNodes")+": " + str(len(rget_missing)) +
+              " of the requested retrons are not in the database: " +
+              ", ".join(rget_missing[:20]) + 
+              (", ..." if len(rget_missing) > 20 else ""))
+    res = format_result([rget_docs[n] for n in rget_nodes if n in rget_docs],
+                        format)
+    if format.lower() == "df":
+        res.attrs['missing'] = rget_missing
+    return res
+
+
+@_profiled
+def iter_retrons(rdb_handle=None, filter=None, batch_size=1000, format="df",
+                 fields=None, exclude=None, sort=None, limit=None, after=None):
+    """
+    Iterate over retrons in batches. Each batch is returned as a JSON string,
+    a list of dictionaries or a ``pandas.DataFrame`` (default) of up to 
+    **batch_size** retrons. The query is run once and its cursor is read 
+    from start to finish, so only one batch is held in memory at a time.
 
     Parameters
     ----------
     rdb_handle : ``pymongo.Collection`` obj
         A retron database collection object, e.g., the output of 
         ``get_retronDB()``
-    filename : ``str``
-        Full path or path relavtive to current working directory, in addition 
-        to the name of the file to be read. The ``.csv`` extension is 
-        automatically added is missing. 
-    new_property : ``bool``, optional
-        Whether to accept novel properties. Default is ``False``.
+    filter : ``dict``, optional
+        A MongoDB query filter, e.g., {"retron (sub)b":{"$eq":"I-A"}}.
+        Default is all retrons.
+    batch_size : ``int``, optional
+        Maximum number of retrons per batch. Default is 1000.
+    format : ``str``, optional
+        Either "json", "dict", or "df" (default)
+    fields : ``list`` of ``str``, optional
+        Properties to return, e.g., ["node","msr/msd familiyc"]. "_id" is 
+        only returned if listed. Default is all properties.
+    exclude : ``list`` of ``str``, optional
+        Properties to leave out, e.g., ["ncrna"]. Cannot be combined with 
+        **fields**.
+    sort : ``str`` or ``list`` of ``str``, optional
+        Properties to sort by, each prefixed with "-" for descending order,
+        e.g., ["msr/msd familiyc", "-node"].
+    limit : ``int``, optional
+        Maximum number of retrons to return. Default is no limit.
+    after : ``str``, optional
+        Only return retrons with a node ID greater than this one, sorted by
+        node ID. Pass the last node ID of one page to get the next page. 
+        Node IDs are compared as strings, e.g., "10" comes before "9".
+    
+    Yields
+    ------
+    str, list of dict, or pandas.DataFrame
+        A batch of retron properties as JSON (str), dictionaries or DataFrame
+        depending on specified format
+    
+    """
+    format = format.lower()
+    if format not in ["json","dict","df"]:
+        raise ValueError ('format must be "json", "dict" or "df"')
+    
+    res = rdb_handle.find(batch_size=batch_size, 
+                          **_find_args(filter, fields, exclude, sort, limit, 
+                                       after))
+    for batch in _cursor_batches(res, batch_size):
+        yield format_result(batch, format)
 
-    Returns
-    -------
-    pandas.DataFrame 
-        DataFrame of added retron properties.
 
+@_profiled
+def summarize_retrons(rdb_handle=None, properties=None, top=20, 
+                      quantiles=(0.25, 0.5, 0.75)):
     """
-    ret_df = read_retron_csv(rdb_handle=rdb_handle, filename=filename)
-    radd_props = set(ret_df.columns)
-    check_new_property(rdb_handle, radd_props, new_property)
+    Summarize retron properties on the server with a single aggregation, 
+    instead of downloading every retron. For each property, counts how many 
+    retrons have a value ("filled"), the number of "distinct" values and the 
+    **top** most frequent values. Values that can be read as numbers, 
+    including numeric strings like "94", are summarized by their "count", 
+    "min", "max", "mean" and **quantiles**. Requires MongoDB 7.0+.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    properties : ``list`` of ``str``, optional
+        Properties to summarize, e.g., ["msr/msd familiyc"]. Default is all
+        properties except "_id".
+    top : ``int``, optional
+        Number of most frequent values to return per property. Default is 20.
+    quantiles : ``tuple`` of ``float``, optional
+        Quantiles of numeric values, approximated on the server. Default is
+        (0.25, 0.5, 0.75).
+    
+    Returns
+    -------
+    dict
+        "total" number of retrons, a "summary" DataFrame with one row per 
+        property, and "frequencies", a dict of ``pandas.Series`` of value 
+        counts per property.
+    
+    """
+    if properties is None:
+        properties = sorted(get_properties(rdb_handle) - {"_id"})
+    quantiles = list(quantiles)
+    q_names = ["{:g}%".format(q * 100) for q in quantiles]
+    
+    # Per-property stages; fields are referenced with $getField since 
+    # property names may contain spaces and punctuation
+    stats = {"_id":None}
+    facets = {"total":[{"$count":"n"}], "stats":[{"$group":stats}]}
+    for i, prop in enumerate(properties):
+        val = {"$getField":prop}
+        num = {"$convert":{"input":val, "to":"double", "onError":None, 
+                           "onNull":None}}
+        stats["filled" + str(i)] = {"$sum":{"$cond":[{"$gt":[val, None]}, 
+                                                     1, 0]}}
+        stats["count" + str(i)] = {"$sum":{"$cond":[{"$gt":[num, None]}, 
+                                                    1, 0]}}
+        stats["min" + str(i)] = {"$min":num}
+        stats["max" + str(i)] = {"$max":num}
+        stats["mean" + str(i)] = {"$avg":num}
+        stats["q" + str(i)] = {"$percentile":{"input":num, "p":quantiles,
+                                              "method":"approximate"}}
+        facets["freq" + str(i)] = [
+            {"$group":{"_id":val, "n":{"$sum":1}}},
+            {"$match":{"_id":{"$ne":None}}},
+            {"$group":{"_id":None, "distinct":{"$sum":1},
+                       "top":{"$topN":{"n":top, "sortBy":{"n":-1}, 
+                                       "output":["$_id", "$n"]}}}}
+            ]
+    
+    res = next(rdb_handle.aggregate([{"$facet":facets}], allowDiskUse=True))
+    total = res['total'][0]['n'] if len(res['total']) > 0 else 0
+    stats = res['stats'][0] if len(res['stats']) > 0 else {}
+    
+    summary = []
+    frequencies = {}
+    for i, prop in enumerate(properties):
+        freq = res["freq" + str(i)]
+        freq = freq[0] if len(freq) > 0 else {"distinct":0, "top":[]}
+        q_vals = stats.get("q" + str(i)) or [None] * len(quantiles)
+        summary.append(dict(
+            {"property":prop, 
+             "filled":stats.get("filled" + str(i), 0),
+             "distinct":freq['distinct'],
+             "count":stats.get("count" + str(i), 0),
+             "min":stats.get("min" + str(i)),
+             "max":stats.get("max" + str(i)),
+             "mean":stats.get("mean" + str(i))},
+            **dict(zip(q_names, q_vals))))
+        frequencies[prop] = pd.Series([n for _, n in freq['top']], 
+                                      index=[v for v, _ in freq['top']],
+                                      name=prop, dtype="int64")
+    summary = pd.DataFrame(summary, columns=["property", "filled", "distinct",
+                           "count", "min", "max", "mean"] + q_names)
+    return {"total":total, "summary":summary.set_index("property"),
+            "frequencies":frequencies}
+
+
+@_profiled
+def get_properties(rdb_handle=None, refresh=False):
+    """
+    Returns the set of property names (keys) used by any retron in the
+    database, including "_id" and "node". 
+    
+    The set is computed on the server by an aggregation pipeline, so only the
+    property names are transferred, and then cached in-process for the given
+    collection. The add and update functions in this module keep the cache
+    current. Use **refresh** or ``clear_property_cache()`` after the database 
+    has been modified by other means.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    refresh : ``bool``, optional
+        Whether to ignore the cache and recompute the set. Default is 
+        ``False``.
+    
+    Returns
+    -------
+    set
+        Property names found in the retron database
+    
+    """
+    rdb_key = _handle_key(rdb_handle)
+    if getattr(type(rdb_handle), "is_local", False):
+        _property_catalog[rdb_key] = rdb_handle.property_names()
+    elif refresh or rdb_key not in _property_catalog:
+        _property_catalog[rdb_key] = set(
+            p['_id'] for p in rdb_handle.aggregate(_properties_pipeline()))
+    return set(_property_catalog[rdb_key])
+
+
+def clear_property_cache(rdb_handle=None):
+    """
+    Drop the cached property names for a retron database, or for all retron
+    databases if no **rdb_handle** is given. The next call to 
+    ``get_properties()`` or ``check_new_property()`` will recompute them.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj, optional
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    
+    Returns
+    -------
+    None
+    
+    """
+    if rdb_handle is None:
+        _property_catalog.clear()
+    else:
+        _property_catalog.pop(_handle_key(rdb_handle), None)
+
+
+def enable_query_cache(max_size=256, ttl=300):
+    """
+    Cache the results of ``get_retron()``, ``get_retrons()``, 
+    ``get_retrons_by()`` and ``get_all_retrons()`` in this process, keyed by
+    database, filter, properties, sort, limit and format. Repeated queries 
+    are then answered without a round trip. The cache is cleared for a 
+    database whenever retrons are added, updated or removed through this 
+    module. Writes by other processes are only seen once entries expire 
+    after **ttl** seconds. Results are copied, so they can be modified.
+
+    Parameters
+    ----------
+    max_size : ``int``, optional
+        Maximum number of cached results; the least recently used are 
+        dropped first. Default is 256. Use 0 to disable the cache.
+    ttl : ``int`` or ``float``, optional
+        Seconds a result stays valid, or ``None`` to keep results until a
+        write. Default is 300.
+    
+    Returns
+    -------
+    None
+    
+    """
+    with _query_cache_lock:
+        _query_cache_stats.update(max_size=max_size, ttl=ttl)
+        while len(_query_cache) > max_size:
+            _query_cache.popitem(last=False)
+
+
+def clear_query_cache(rdb_handle=None):
+    """
+    Drop the cached query results for a retron database, or for all retron
+    databases if no **rdb_handle** is given (see ``enable_query_cache()``).
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj, optional
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    
+    Returns
+    -------
+    None
+    
+    """
+    with _query_cache_lock:
+        _query_cache_stats['generation'] += 1
+        if rdb_handle is None:
+            _query_cache.clear()
+            return
+        rdb_key = _handle_key(rdb_handle)
+        for key in [k for k in _query_cache if k[0] == rdb_key]:
+            del _query_cache[key]
+            _query_cache_stats['invalidations'] += 1
+
+
+def query_cache_stats():
+    """
+    Statistics of the query cache (see ``enable_query_cache()``).
+    
+    Returns
+    -------
+    dict
+        The "max_size" and "ttl" settings, the number of cached results 
+        ("size"), "hits", "misses", "evictions" of least recently used or 
+        expired results, and "invalidations" by writes.
+    
+    """
+    with _query_cache_lock:
+        stats = {k:v for k, v in _query_cache_stats.items() 
+                 if k != "generation"}
+        stats['size'] = len(_query_cache)
+    return stats
+
+
+@_profiled
+def sync_snapshot(rdb_handle=None, cache_dir=None, full=False):
+    """
+    Sync and return a local snapshot of all retrons. The snapshot is an 
+    uncompressed Arrow file that is memory-mapped when read. 
+    
+    The first sync downloads every retron. Later syncs only download retrons
+    that the add, update and remove functions in this module have logged as 
+    changed since the previous sync, and drop removed retrons. Use **full** 
+    after the database has been modified by other means. Requires the 
+    ``pyarrow`` package.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    cache_dir : ``str``, optional
+        Directory for snapshot files. Default is ``SNAPSHOT_DIR``.
+    full : ``bool``, optional
+        Whether to download every retron again. Default is ``False``.
+    
+    Returns
+    -------
+    pandas.DataFrame 
+        DataFrame of all retrons. The "_id" values are strings.
+    
+    """
+    feather = _require("pyarrow.feather", 'source="cache"')
+    if cache_dir is None:
+        cache_dir = SNAPSHOT_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    snap_file = os.path.join(cache_dir, _handle_key(rdb_handle) + ".arrow")
+    meta_file = os.path.join(cache_dir, _handle_key(rdb_handle) + ".json")
+    rdb_log = _changes_handle(rdb_handle)
+    
+    snap_meta = None
+    if not full and os.path.exists(meta_file) and os.path.exists(snap_file):
+        with open(meta_file) as f:
+            snap_meta = json.load(f)
+    
+    if snap_meta is None:
+        # Full download; changes logged from here on are synced next time
+        last_log = rdb_log.find_one({}, sort=[("modified", -1)])
+        synced = None if last_log is None else last_log['modified']
+        recent = {}
+        snap_df = _collect_batches(iter_retrons(rdb_handle), "df")
+    else:
+        # Changes since the last sync, minus those applied in the overlap
+        synced = snap_meta['synced']
+        recent = snap_meta['recent']
+        if synced is not None:
+            synced = datetime.datetime.fromisoformat(synced)
+            log_filter = {"modified":{"$gte":synced - SNAPSHOT_OVERLAP}}
+        else:
+            log_filter = {}
+        snap_log = [l for l in rdb_log.find(log_filter) 
+                    if recent.get(l['node']) != l['modified'].isoformat()]
+        snap_df = feather.read_table(snap_file, memory_map=True).to_pandas()
+        if len(snap_log) == 0:
+            return snap_df
+        
+        # Replace changed retrons and drop removed ones
+        synced = max([l['modified'] for l in snap_log] + 
+                     ([] if synced is None else [synced]))
+        recent.update((l['node'], l['modified'].isoformat()) for l in snap_log)
+        recent = {n: m for n, m in recent.items() if 
+                  datetime.datetime.fromisoformat(m) >= synced - SNAPSHOT_OVERLAP}
+        chg_nodes = list(set(l['node'] for l in snap_log))
+        chg_batches = itertools.chain.from_iterable(
+            iter_retrons(rdb_handle, {"node":{"$in":nodes}}) 
+            for nodes in _cursor_batches(iter(chg_nodes), 10000))
+        if 'node' in snap_df:
+            snap_df = snap_df[~snap_df['node'].isin(chg_nodes)]
+        snap_df = _collect_batches(itertools.chain([snap_df], chg_batches), 
+                                   "df")
+    
+    if "_id" in snap_df:
+        snap_df["_id"] = snap_df["_id"].astype(str)
+    feather.write_feather(_arrow_safe(snap_df), snap_file, 
+                          compression="uncompressed")
+    _write_json_atomic(meta_file, {"synced": None if synced is None else 
+                                   synced.isoformat(), 
+                                   "recent":recent, "count":len(snap_df)})
+    return snap_df
+
+
+###############################################################################
+# ADD FUNCTIONS
+@_profiled
+def add_retron(rdb_handle=None, retron_dict=None, new_property=False):
+    """
+    Add a single retron given a dictionary. The ``dict`` must include a unique
+    identifier key called "node" with a string-encoded integer, e.g., "node":"0".
+    
+    All properties will be checked against current database properties. By 
+    default, unrecognized properties will be rejected (see **new_property** parameter).
+    Values of declared properties are converted to their types (see 
+    ``apply_schema()``).
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    retron_dict : ``dict``
+        A dictionary with retron data
+    new_property : ``bool``, optional
+        Whether to accept novel properties. Default is ``False``.
+
+    Returns
+    -------
+    pandas.DataFrame 
+        DataFrame of added retron properties.
+
+    """
+    radd_props = set(retron_dict.keys())
+    if "node" not in radd_props:
+        # SKIP: assigning new node ID if missing; might be too dangerous?
+        # res = rdb_handle.find().sort("node", -1)
+        # max_node = format_result(res[0], "df")['node'][0]
+        # retron_dict['node'] = str(int(max_node) +1)
+        # print("Assigning unique node ID...\n")
+        raise MissingKeyError()
+    else:
+        # force string values for node IDs
+        retron_dict['node'] = str(retron_dict['node'])
+        # "node" is indexed so, duplicates will be caught automatically
+       
+    check_new_property(rdb_handle, radd_props, new_property)
+    retron_dict = _apply_schema_dict(retron_dict)
+    
+    try:
+        radd_obj = rdb_handle.insert_one(retron_dict)
+    except pm.errors.DuplicateKeyError:
+        print(ansiRed.format("DuplicateKeyError")+": \"" +
+          retron_dict['node'] + "\" A retron with this" +
+              " same node ID already exists in the database. Either" +
+              " change the node ID"+
+              " or consider using update_retron().")
+    except Exception as e:
+        print(ansiRed.format("Error")+": Failed to add retron.\n", e)
+    else:
+        radd_id = radd_obj.inserted_id
+        _after_write(rdb_handle, [retron_dict['node']], radd_props | {"_id"})
+        print("Added retron to the database.")
+        radd_res = rdb_handle.find_one({"_id":radd_id})
+        return format_result(radd_res)
+        
+
+
+@_profiled
+def add_retrons_by_csv(rdb_handle=None, filename=None, new_property=False,
+                       chunksize=None, checkpoint=None):
+    """
+    Add one or more retrons given a CSV file. There must be
+    a unique integer identifier for each row in a column named "node".
+    
+    All properties will be checked against current database properties. By 
+    default, unrecognized properties will be rejected (see **new_property** parameter).
+    
+    For large files, set **chunksize** to stream the file instead of loading
+    it all at once. Each chunk is inserted with an unordered bulk write, so 
+    duplicate node IDs are skipped without stopping the import. Set 
+    **checkpoint** to a file path to record the number of committed rows 
+    after each chunk; if the import is interrupted, running it again with the 
+    same checkpoint resumes after the last committed chunk. The checkpoint 
+    file is removed once the import completes, and resuming from the 
+    checkpoint of a different or modified file raises a ``ValueError``.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    filename : ``str``
+        Full path or path relavtive to current working directory, in addition 
+        to the name of the file to be read. The ``.csv`` extension is 
+        automatically added is missing. 
+    new_property : ``bool``, optional
+        Whether to accept novel properties. Default is ``False``.
+    chunksize : ``int``, optional
+        Number of CSV rows to read and insert at a time. Default is to read
+        the whole file.
+    checkpoint : ``str``, optional
+        Path to a checkpoint file for resuming a chunked import. Only used 
+        with **chunksize**.
+
+    Returns
+    -------
+    pandas.DataFrame 
+        DataFrame of added retron properties. With **chunksize**, a DataFrame
+        with one row per chunk instead, reporting the "start" and "stop" CSV 
+        rows and the number of retrons "inserted", rejected as "duplicates", 
+        or "failed" otherwise.
+
+    """
+    if chunksize is not None:
+        return _add_retrons_by_chunks(rdb_handle, filename, new_property,
+                                      chunksize, checkpoint)
+    
+    ret_df = read_retron_csv(rdb_handle=rdb_handle, filename=filename)
+    radd_props = set(ret_df.columns)
+    check_new_property(rdb_handle, radd_props, new_property)
     
     # DF to dict
-    ret_js = ret_df.to_json(orient='records')
-    ret_dict = json.loads(ret_js)
+    ret_dict = _df_to_records(ret_df)
+    radd_ids = []
     try:
         radd_obj = rdb_handle.insert_many(ret_dict)
     except pm.errors.BulkWriteError as e:
@@ -373,13 +1685,91 @@ def add_retrons_by_csv(rdb_handle=None, filename=None, new_property=False):
         radd_ids = radd_obj.inserted_ids
     finally:
         if len(radd_ids) > 0:
+            _after_write(rdb_handle, 
+                         [r['node'] for r in ret_dict[:len(radd_ids)]],
+                         radd_props | {"_id"})
             print("Added retrons to the database.")
         radd_res = rdb_handle.find({"_id":{"$in":radd_ids}})
         return format_result(radd_res)
     
+
+def _add_retrons_by_chunks(rdb_handle=None, filename=None, new_property=False,
+                           chunksize=10000, checkpoint=None):
+    """
+    Streaming mode of ``add_retrons_by_csv()``. See **chunksize** and 
+    **checkpoint** there.
+    """
+    # Resume after the last committed row, if any, of the same file
+    done_rows = 0
+    csv_source = _checkpoint_source(filename)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            ckpt = json.load(f)
+        ckpt_diff = [k for k, v in csv_source.items() if ckpt.get(k, v) != v]
+        if len(ckpt_diff) > 0:
+            raise ValueError ("Checkpoint " + checkpoint + " is for a" +
+                              " different or modified file (" + 
+                              str(ckpt.get('filename')) + "). Remove it to" +
+                              " import " + csv_source['filename'] + 
+                              " from the start.")
+        done_rows = ckpt['rows']
+        print("Resuming import after row " + str(done_rows) + ".")
+    
+    radd_report = []
+    radd_props = None
+    for nrows, ret_df in _read_retron_chunks(filename, chunksize, done_rows):
+        if radd_props is None:
+            radd_props = set(ret_df.columns)
+            check_new_property(rdb_handle, radd_props, new_property)
+        
+        # DF to dict
+        ret_dict = _df_to_records(ret_df)
+        radd_stats = {"start":done_rows, "stop":done_rows + nrows,
+                      "inserted":0, "duplicates":0, "failed":0}
+        radd_errs = set()
+        if len(ret_dict) > 0:
+            try:
+                radd_obj = rdb_handle.insert_many(ret_dict, ordered=False)
+            except pm.errors.BulkWriteError as e:
+                radd_stats["inserted"] = e.details['nInserted']
+                for err in e.details['writeErrors']:
+                    radd_errs.add(err['index'])
+                    if err['code'] == 11000:
+                        radd_stats["duplicates"] += 1
+                    else:
+                        radd_stats["failed"] += 1
+            else:
+                radd_stats["inserted"] = len(radd_obj.inserted_ids)
+        radd_report.append(radd_stats)
+        if radd_stats["inserted"] > 0:
+            _after_write(rdb_handle, [r['node'] for i, r in 
+                                      enumerate(ret_dict) 
+                                      if i not in radd_errs],
+                         radd_props | {"_id"})
+        
+        # Record committed rows
+        done_rows += nrows
+        if checkpoint is not None:
+            _write_json_atomic(checkpoint, {**csv_source, "rows":done_rows})
+    
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    
+    radd_report = pd.DataFrame(radd_report, columns=["start", "stop", 
+                               "inserted", "duplicates", "failed"])
+    num_dups = radd_report['duplicates'].sum()
+    if num_dups > 0:
+        print(ansiRed.format("DuplicateKeyError")+": " + str(num_dups) + 
+              " retrons with node IDs already in the database were" +
+              " skipped. Consider using update_retrons_by_csv().")
+    print("Added " + str(radd_report['inserted'].sum()) + 
+          " retrons to the database.")
+    return radd_report
+    
 ###############################################################################
 # UPDATE FUNCTIONS
 
+@_profiled
 def update_retron(rdb_handle=None, retron_dict=None, new_property=False):
     """
     Update an existing retron given a dictionaty. The ``dict`` must include a unique
@@ -387,6 +1777,8 @@ def update_retron(rdb_handle=None, retron_dict=None, new_property=False):
     
     All properties will be checked against current database properties. By 
     default, unrecognized properties will be rejected (see **new_property** parameter).
+    Values of declared properties are converted to their types (see 
+    ``apply_schema()``).
 
     Parameters
     ----------
@@ -414,6 +1806,7 @@ def update_retron(rdb_handle=None, retron_dict=None, new_property=False):
         retron_dict['node'] = str(retron_dict['node'])
        
     check_new_property(rdb_handle, rupd_props, new_property)
+    retron_dict = _apply_schema_dict(retron_dict)
     
     # Get node list for update keys
     rupd_node = str(retron_dict['node'])
@@ -422,11 +1815,14 @@ def update_retron(rdb_handle=None, retron_dict=None, new_property=False):
     except Exception as e:
         print(ansiRed.format("Error")+": Failed to update retron.\n", e)
     else:
+        _after_write(rdb_handle, [rupd_node], rupd_props)
         print("Updated retron in the database.")
         rupd_res = rdb_handle.find({"node":{"$eq":rupd_node}})
         return format_result(rupd_res)
 
-def update_retrons_by_csv(rdb_handle=None, filename=None, new_property=False, add=False):
+@_profiled
+def update_retrons_by_csv(rdb_handle=None, filename=None, new_property=False, 
+                          add=False, batch_size=1000, diff=False, dry_run=False):
     """
     Update one or more existing retrons given a CSV file. There must be
     a unique integer identifier for each row in a column named "node".
@@ -436,6 +1832,14 @@ def update_retrons_by_csv(rdb_handle=None, filename=None, new_property=False, ad
     
     Only pre-existing retrons will be updated. Rows pertaining to new retrons
     will be ignored unless **add**=True.
+    
+    Updates are sent as unordered bulk writes of up to **batch_size** rows, 
+    so a failed row does not stop the others from being updated.
+    
+    With **diff**=True, the current values of the retrons in the file are 
+    fetched in one query and only the properties that actually changed are 
+    sent. Empty cells matching absent properties are not written as nulls.
+    Use **dry_run**=True to preview these changes without writing anything.
 
     Parameters
     ----------
@@ -450,11 +1854,27 @@ def update_retrons_by_csv(rdb_handle=None, filename=None, new_property=False, ad
         Whether to accept novel properties. Default is ``False``.
     add : ``bool``, optional
         Whether to add new retrons if not previously entered.
+    batch_size : ``int``, optional
+        Maximum number of updates per bulk write. Default is 1000.
+    diff : ``bool``, optional
+        Whether to only send properties that differ from the database.
+        Default is ``False``.
+    dry_run : ``bool``, optional
+        Whether to only report the changes a **diff** update would make. 
+        Implies **diff**. Default is ``False``.
             
     Returns
     -------
     pandas.DataFrame 
-        DataFrame of added retron properties.
+        DataFrame reporting the "node", "status" and failure "reason" for each
+        row of the CSV file. Status is "matched" (an existing retron was
+        updated), "upserted" (a new retron was added), "unchanged" (nothing
+        to update with **diff**), "skipped" (no such retron and **add** is 
+        False) or "failed". Totals for matched, modified and upserted retrons 
+        are in the ``attrs`` of the DataFrame.
+        
+        With **dry_run**, a DataFrame of the "node", "property", "old" and 
+        "new" value of each change instead.
 
     """
     ret_df = read_retron_csv(rdb_handle=rdb_handle, filename=filename)
@@ -462,31 +1882,113 @@ def update_retrons_by_csv(rdb_handle=None, filename=None, new_property=False, ad
     check_new_property(rdb_handle, rupd_props, new_property)
     
     #DF to dict
-    ret_js = ret_df.to_json(orient='records')
-    ret_dict_list = json.loads(ret_js)
-    # Get node list for update keys
-    for retron_dict in ret_dict_list:
-        rupd_node = str(retron_dict['node'])
+    ret_dict_list = _df_to_records(ret_df)
+    rupd_nodes = [str(r['node']) for r in ret_dict_list]
+    
+    diff = diff or dry_run
+    
+    # Find pre-existing retrons (and their current values) in one query
+    rupd_proj = {p:1 for p in ret_df.columns} if diff else {"node":1}
+    rdb_cur = pd.DataFrame(list(rdb_handle.find(
+        {"node":{"$in":rupd_nodes}}, {"_id":0, **rupd_proj})))
+    rdb_nodes = set(rdb_cur['node']) if len(rdb_cur) else set()
+    rupd_status = ["matched" if n in rdb_nodes else 
+                   ("upserted" if add else "skipped") for n in rupd_nodes]
+    rupd_reason = [None] * len(rupd_nodes)
+    rupd_sets = ret_dict_list
+    
+    if diff:
+        # Align current values with the file, row by row, then compare
+        rupd_new = ret_df.reset_index(drop=True).astype(object)
+        if len(rdb_cur):
+            rupd_old = rdb_cur.set_index('node').reindex(rupd_nodes)
+        else:
+            rupd_old = pd.DataFrame(index=rupd_nodes)
+        rupd_old = (rupd_old.reset_index(drop=True)
+                    .reindex(columns=rupd_new.columns).astype(object))
+        rupd_old['node'] = rupd_new['node']
+        rupd_same = ((rupd_old == rupd_new).fillna(False).astype(bool) | 
+                     (rupd_old.isna() & rupd_new.isna()))
+        rupd_changed = ~rupd_same.to_numpy()
+        rupd_changed[[st == "skipped" for st in rupd_status]] = False
+        rupd_cols = rupd_new.columns
+        rupd_sets = [{p:ret_dict_list[i][p] for p in rupd_cols[rupd_changed[i]]}
+                     for i in range(len(rupd_nodes))]
+        
+        if dry_run:
+            rows, cols = rupd_changed.nonzero()
+            rupd_changes = pd.DataFrame({
+                "node":[rupd_nodes[i] for i in rows],
+                "property":rupd_cols[cols],
+                "old":rupd_old.to_numpy()[rows, cols],
+                "new":rupd_new.to_numpy()[rows, cols]})
+            print("Changes to retrons in the database: " + 
+                  str(len(rupd_changes)) + " values in " + 
+                  str(rupd_changes['node'].nunique()) + " retrons.")
+            return rupd_changes
+        
+        # New retrons are added whole, even with only a node ID
+        rupd_status = ["unchanged" if st == "matched" and not rupd_sets[i] 
+                       else st for i, st in enumerate(rupd_status)]
+        rupd_sets = [ret_dict_list[i] if st == "upserted" else rupd_sets[i]
+                     for i, st in enumerate(rupd_status)]
+    
+    rupd_rows = [i for i, st in enumerate(rupd_status) 
+                 if st not in ("skipped", "unchanged")]
+    rupd_totals = {"matched":0, "modified":0, "upserted":0}
+    
+    for batch in _cursor_batches(iter(rupd_rows), batch_size):
+        rupd_ops = [pm.UpdateOne({"node":rupd_nodes[i]},
+                                 {"$set":rupd_sets[i]}, upsert=add) 
+                    for i in batch]
         try:
-            rdb_handle.update_one({"node":rupd_node},{"$set":retron_dict},
-                                  upsert=add)
+            rupd_obj = rdb_handle.bulk_write(rupd_ops, ordered=False)
+            rupd_details = rupd_obj.bulk_api_result
+        except pm.errors.BulkWriteError as e:
+            rupd_details = e.details
         except Exception as e:
-            print(ansiRed.format("Error")+": Failed to update retrons.\n", e)
-    print("Updated retrons in the database.")
-    rupd_nodes = list(ret_df['node'])
-    rupd_res = rdb_handle.find({"node":{"$in":rupd_nodes}})
-    return format_result(rupd_res)
+            rupd_details = {"writeErrors":[{"index":j, "errmsg":str(e)} 
+                                           for j in range(len(batch))]}
+        rupd_totals["matched"] += rupd_details.get("nMatched", 0)
+        rupd_totals["modified"] += rupd_details.get("nModified", 0)
+        rupd_totals["upserted"] += rupd_details.get("nUpserted", 0)
+        for err in rupd_details.get("writeErrors", []):
+            rupd_status[batch[err['index']]] = "failed"
+            rupd_reason[batch[err['index']]] = err.get('errmsg')
+    
+    rupd_report = pd.DataFrame({"node":rupd_nodes, "status":rupd_status,
+                                "reason":rupd_reason})
+    rupd_report.attrs.update(rupd_totals)
+    
+    rupd_failed = rupd_report[rupd_report['status'] == "failed"]
+    for node, reason in zip(rupd_failed['node'], rupd_failed['reason']):
+        print(ansiRed.format("Error")+": Failed to update retron \"" + 
+              node + "\".\n", reason)
+    if len(rupd_failed) < len(rupd_rows):
+        rupd_written = set().union(*(rupd_sets[i] for i in rupd_rows)) 
+        _after_write(rdb_handle, [rupd_nodes[i] for i in rupd_rows 
+                                  if rupd_status[i] != "failed"], 
+                     (rupd_written if diff else rupd_props) | {"_id"})
+    print("Updated retrons in the database: " + 
+          str(rupd_totals["matched"]) + " matched (" + 
+          str(rupd_totals["modified"]) + " modified), " +
+          str(rupd_totals["upserted"]) + " added, " + 
+          str(len(rupd_failed)) + " failed.")
+    return rupd_report
 
     
 
 ###############################################################################
 # REMOVE FUNCTIONS
+@_profiled
 def remove_retron(rdb_handle=None, node=None):
     """
     IMPORTANT: This action will delete a retron and all of its properties from 
     the database!
 
-    Remove a retron given its node identifier. 
+    Remove a retron given its node identifier. The retron is archived in 
+    the trash collection first, so it can be brought back with 
+    ``restore_removed()``.
 
     Parameters
     ----------
@@ -499,8 +2001,8 @@ def remove_retron(rdb_handle=None, node=None):
     Returns
     -------
     pandas.DataFrame 
-        DataFrame of removed retron properties. Last chance to recover deleted 
-        data!
+        DataFrame of removed retron properties. The removal ID for 
+        ``restore_removed()`` is in ``attrs['removal']``.
 
     """
     if isinstance(node, list):
@@ -508,13 +2010,14 @@ def remove_retron(rdb_handle=None, node=None):
                          " you have a list, or consider using " +
                          " remove_retrons_by() with the set syntax.")
 
-    gone = get_retron(rdb_handle, node)
-    rdb_handle.delete_one({"node":str(node)})
+    gone = _remove_retrons(rdb_handle, {"node":str(node)})
     print("Removed a retron from the database.")
     return gone
     
     
-def remove_retrons_by(rdb_handle=None, key="node", value=None ):
+@_profiled
+def remove_retrons_by(rdb_handle=None, key="node", value=None, 
+                      batch_size=1000):
     """
     IMPORTANT: This action will delete retrons and all of their properties from 
     the database!
@@ -528,7 +2031,14 @@ def remove_retrons_by(rdb_handle=None, key="node", value=None ):
     * $eq - Matches values that are equal to a specified value.
     * $ne - Matches all values that are not equal to a specified value.
     * $in - Matches any of the values specified in an array. Sensitive to type.
-    * $nin - Matches none of the values specified in an array. Sensitive to type.\
+    * $nin - Matches none of the values specified in an array. Sensitive to type.
+    
+    The matching retrons are read once and archived in the trash collection,
+    then deleted by their "_id", so retrons added in the meantime are never
+    deleted unseen. Each batch is archived and deleted in one transaction 
+    where the server supports transactions (replica sets and Atlas), and 
+    archived before it is deleted otherwise. Use ``restore_removed()`` to
+    undo.
     
     Parameters
     ----------
@@ -539,12 +2049,14 @@ def remove_retrons_by(rdb_handle=None, key="node", value=None ):
         Property key or name, e.g., "genus"
     value : ``str``, ``int``, ``float`` or ``set``
         Propery value, e.g., "Escherichia" or set of conditions, e.g., {"$gt":5}
+    batch_size : ``int``, optional
+        Number of retrons archived and deleted at a time. Default is 1000.
     
     Returns
     -------
     pandas.DataFrame 
-        DataFrame of removed retrons and their properties. Last chance to 
-        recover deleted data!
+        DataFrame of removed retrons and their properties. The removal ID for
+        ``restore_removed()`` is in ``attrs['removal']``.
 
     """
     if isinstance(value, list):
@@ -554,94 +2066,1039 @@ def remove_retrons_by(rdb_handle=None, key="node", value=None ):
         
     if key == "node" and isinstance(value, int):
         value = str(value)
+    value = _coerce_query_value(key, value)
         
-    gone = get_retrons_by(rdb_handle, key, value)
-    rdb_handle.delete_many({str(key):value})
+    gone = _remove_retrons(rdb_handle, {str(key):value}, batch_size)
     print("Removed retrons from the database.")
     return gone
-    
-    
-###############################################################################
-# INTERNAL FUNCTIONS
-def read_retron_csv(rdb_handle=None, filename=None):
+
+
+@_profiled
+def restore_removed(rdb_handle=None, removal=None, nodes=None, 
+                    batch_size=1000):
     """
-    Read, clean and validate retron data from a CSV file. There must be
-    a unique integer identifier for each row in a column named "node".
-    
-    All properties will be checked against current database properties. By 
-    default, unrecognized properties will be rejected (see **new_property** parameter).
+    Bring back retrons from the trash collection, e.g., to undo 
+    ``remove_retrons_by()``. Retrons are restored with their original "_id"
+    and properties. Retrons whose node ID is in the database again are 
+    skipped and stay in the trash.
 
     Parameters
     ----------
     rdb_handle : ``pymongo.Collection`` obj
         A retron database collection object, e.g., the output of 
         ``get_retronDB()``
-    filename : ``str``
-        Full path or path relavtive to current working directory, in addition 
-        to the name of the file to be read. The ``.csv`` extension is 
-        automatically added is missing. 
-        
+    removal : ``str``, optional
+        Removal ID, from ``attrs['removal']`` of the DataFrame returned by 
+        the remove functions. Default is the most recent removal.
+    nodes : ``list`` of ``str``, optional
+        Node IDs to restore instead, from whichever removal they were last 
+        removed by.
+    batch_size : ``int``, optional
+        Number of retrons restored at a time. Default is 1000.
+
     Returns
     -------
     pandas.DataFrame 
-        DataFrame of cleaned and validated csv data
+        DataFrame of restored retrons and their properties
 
     """
-    if re.search('.csv$', filename) is None: filename += '.csv'  
-    ret_df = pd.read_csv(filename, dtype=str)
-    ret_cols = ret_df.columns
+    rdb_trash = _trash_handle(rdb_handle)
+    if nodes is not None:
+        trash_filter = {"node":{"$in":[str(n) for n in nodes]}}
+    else:
+        if removal is None:
+            last = rdb_trash.find_one({}, sort=[("removed", -1)])
+            if last is None:
+                print("There are no removed retrons to restore.")
+                return format_result([], "df")
+            removal = last['removal']
+        trash_filter = {"removal":bson.ObjectId(removal)}
     
-    # Drop "_id" if present (e.g., from backup file)
-    if "_id" in ret_cols:
-        ret_df = ret_df.drop('_id',1)
+    # The latest archived copy of each retron
+    trash_entries = {}
+    for e in rdb_trash.find(trash_filter, sort=[("removed", 1)]):
+        trash_entries[e['node']] = e
     
-    # Check node IDs
-    if "node" not in ret_cols:
-       raise MissingKeyError("There must be a \"node\" column.")
-    ret_df = ret_df[ret_df['node']>="0"]
+    restored = []
+    num_skipped = 0
+    for batch in _cursor_batches(iter(trash_entries.values()), batch_size):
+        batch_docs = [e['retron'] for e in batch]
+        batch_failed = set()
+        try:
+            rdb_handle.insert_many(batch_docs, ordered=False)
+        except pm.errors.BulkWriteError as e:
+            batch_failed = set(err['index'] for err in 
+                               e.details['writeErrors'])
+        batch_ok = [e for i, e in enumerate(batch) if i not in batch_failed]
+        num_skipped += len(batch_failed)
+        if len(batch_ok) > 0:
+            rdb_trash.delete_many({"_id":{"$in":[e['_id'] for e in batch_ok]}})
+            restored.extend(e['retron'] for e in batch_ok)
+            _after_write(rdb_handle, [e['node'] for e in batch_ok], 
+                         set().union(*(e['retron'] for e in batch_ok)))
     
-    # Strip leading and trailing blanks
-    ret_df = ret_df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
+    print("Restored " + str(len(restored)) + " retrons to the database." +
+          (" Skipped " + str(num_skipped) + " that are in the database " +
+           "again." if num_skipped > 0 else ""))
+    return format_result(restored, "df")
     
-    return ret_df
     
-def check_new_property(rdb_handle=None, props=None, new_property=False):
+###############################################################################
+# SEARCH FUNCTIONS
+@_profiled
+def build_kmer_index(rdb_handle=None, k=8, batch_size=1000):
     """
-    Check incoming properties against existing properties in retron database.
-    If new_property is False (default), then novel properties will be rejected.
-    
-    This check is intended to help protect against inserting typos and other
-    unintended property names into the database.
-    
+    Build (or rebuild) a k-mer index of retron ncRNA sequences for 
+    ``search_sequence()``. Each sequence is encoded 2 bits per nucleotide 
+    and its distinct k-mers are stored as integers in a side collection 
+    with a multikey index. Once built, the add, update and remove functions
+    in this module keep the index current.
+
     Parameters
     ----------
     rdb_handle : ``pymongo.Collection`` obj
         A retron database collection object, e.g., the output of 
         ``get_retronDB()``
-        
-    new_property : ``bool``, optional
-        Whether to accept novel properties. Default is ``False``.  
-        
+    k : ``int``, optional
+        Length of k-mers, from 4 to 31. Default is 8.
+    batch_size : ``int``, optional
+        Number of sequences to index at a time. Default is 1000.
+    
     Returns
     -------
-    None
+    int
+        Number of indexed sequences
     
     """
-    rdb_props = functools.reduce( lambda all_keys, rec_keys: all_keys | set(rec_keys), map(lambda d: d.keys(), rdb_handle.find()), set() )
-    radd_new = props.difference(rdb_props)
-    if len(radd_new) > 0 and not new_property:
-        raise UnrecognizedPropertyError(radd_new)
-        
+    if not 4 <= k <= 31:
+        raise ValueError ("k must be between 4 and 31")
+    rdb_kmers = rdb_handle.database[rdb_handle.name + KMERS_SUFFIX]
+    rdb_kmers.drop()
+    _kmer_k.pop(_handle_key(rdb_handle), None)
+    
+    num_seqs = 0
+    res = rdb_handle.find({"ncrna":{"$type":"string"}}, 
+                          {"_id":0, "node":1, "ncrna":1})
+    for batch in _cursor_batches(res, batch_size):
+        rdb_kmers.insert_many([{"_id":r['node'], 
+                                "kmers":_encode_kmers(r['ncrna'], k).tolist()}
+                               for r in batch])
+        num_seqs += len(batch)
+    rdb_kmers.create_index("kmers")
+    rdb_kmers.insert_one({"_id":"_meta", "k":k})
+    _kmer_k[_handle_key(rdb_handle)] = (k, time.monotonic())
+    print("Indexed " + str(num_seqs) + " ncRNA sequences.")
+    return num_seqs
 
-def format_result(result=None, format="df"):
+
+@_profiled
+def search_sequence(rdb_handle=None, query=None, min_shared=None, limit=20,
+                    substring=False):
+    """
+    Find retrons with ncRNA sequences similar to a **query** sequence, ranked 
+    by the number of distinct k-mers they share with it. Uses the k-mer 
+    index; see ``build_kmer_index()``. U is read as T and case is ignored.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    query : ``str``
+        A nucleotide sequence at least k long
+    min_shared : ``int``, optional
+        Minimum number of shared k-mers. Default is half of the query's 
+        distinct k-mers.
+    limit : ``int``, optional
+        Maximum number of retrons to return. Default is 20.
+    substring : ``bool``, optional
+        Whether to only return retrons whose ncRNA contains the query. 
+        Default is ``False``.
+    
+    Returns
+    -------
+    pandas.DataFrame 
+        DataFrame with the "node", number of "shared" k-mers and "score" 
+        (fraction of query k-mers shared) of each matching retron
+    
+    """
+    k = _kmer_index_k(rdb_handle)
+    if k is None:
+        raise ValueError ("There is no k-mer index. Run build_kmer_index()" +
+                          " first.")
+    q_kmers = _encode_kmers(query, k).tolist()
+    if len(q_kmers) == 0:
+        raise ValueError ("The query must have at least " + str(k) + 
+                          " nucleotides (A, C, G, T or U).")
+    if substring:
+        min_shared = len(q_kmers)
+    elif min_shared is None:
+        min_shared = max(1, len(q_kmers) // 2)
+    
+    rdb_kmers = rdb_handle.database[rdb_handle.name + KMERS_SUFFIX]
+    pipeline = [
+        {"$match":{"kmers":{"$in":q_kmers}}},
+        {"$project":{"shared":{"$size":{"$setIntersection":
+                                        ["$kmers", q_kmers]}}}},
+        {"$match":{"shared":{"$gte":min_shared}}},
+        {"$sort":{"shared":-1, "_id":1}}
+        ]
+    if not substring:
+        pipeline.append({"$limit":limit})
+    hits = list(rdb_kmers.aggregate(pipeline))
+    
+    # Confirm candidates that share every k-mer
+    if substring:
+        q_seq = query.upper().replace("U", "T")
+        seqs = {r['node']:r['ncrna'].upper().replace("U", "T") for r in 
+                rdb_handle.find({"node":{"$in":[h['_id'] for h in hits]}},
+                                {"_id":0, "node":1, "ncrna":1})}
+        hits = [h for h in hits if q_seq in seqs.get(h['_id'], "")][:limit]
+    
+    return pd.DataFrame({"node":[h['_id'] for h in hits],
+                         "shared":[h['shared'] for h in hits],
+                         "score":[h['shared'] / len(q_kmers) for h in hits]})
+
+
+###############################################################################
+# INTERNAL FUNCTIONS
+@_profiled
+def read_retron_csv(rdb_handle=None, filename=None, chunksize=None):
+    """
+    Read, clean and validate retron data from a CSV file. There must be
+    a unique integer identifier for each row in a column named "node".
+    
+    All properties will be checked against current database properties. By 
+    default, unrecognized properties will be rejected (see **new_property** parameter).
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    filename : ``str``
+        Full path or path relavtive to current working directory, in addition 
+        to the name of the file to be read. The ``.csv`` extension is 
+        automatically added is missing. 
+    chunksize : ``int``, optional
+        Number of rows per chunk. If given, an iterator of DataFrames is 
+        returned instead of a single DataFrame.
+        
+    Returns
+    -------
+    pandas.DataFrame 
+        DataFrame of cleaned and validated csv data
+        
+    Raises
+    ------
+    CSVValidationError
+        If node IDs are not non-negative integers or are repeated, or values
+        do not match the property schema. Its ``report`` lists every problem.
+
+    """
+    if chunksize is not None:
+        return (ret_df for _, ret_df in 
+                _read_retron_chunks(filename, chunksize))
+    
+    if re.search(r'\.csv(\.gz|\.zst)?$', filename) is None: filename += '.csv'  
+    ret_df = pd.read_csv(filename, dtype=str, engine=_csv_engine(filename))
+    return _clean_retron_df(ret_df)
+
+
+@_profiled
+def validate_retron_csv(filename=None):
+    """
+    Check a retron CSV file without touching the database. The file is 
+    cleaned as by ``read_retron_csv()`` and every problem found is reported.
+
+    Parameters
+    ----------
+    filename : ``str``
+        Full path or path relavtive to current working directory, in addition 
+        to the name of the file to be read. The ``.csv`` extension is 
+        automatically added is missing. 
+        
+    Returns
+    -------
+    pandas.DataFrame 
+        DataFrame of the "line", "node", "property", "value" and "error" of 
+        each problem (see ``CSVValidationError``). Empty if the file is valid.
+
+    """
+    try:
+        read_retron_csv(filename=filename)
+    except CSVValidationError as e:
+        return e.report
+    return pd.DataFrame(columns=["line", "node", "property", "value", "error"])
+
+
+def _read_retron_chunks(filename=None, chunksize=10000, skip=0):
+    """
+    Read, clean and validate a retron CSV file in chunks, after skipping the
+    first **skip** rows. Yields the number of rows read and the cleaned 
+    DataFrame for each chunk.
+    """
+    if re.search(r'\.csv(\.gz|\.zst)?$', filename) is None: filename += '.csv'  
+    ret_chunks = pd.read_csv(filename, dtype=str, chunksize=chunksize,
+                             skiprows=range(1, skip + 1))
+    for ret_df in ret_chunks:
+        ret_df.index += skip
+        yield len(ret_df), _clean_retron_df(ret_df)
+
+
+def _checkpoint_source(filename=None):
+    """
+    The CSV file a checkpoint of ``add_retrons_by_csv()`` belongs to: its 
+    full path, size and modification time.
+    """
+    if re.search(r'\.csv(\.gz|\.zst)?$', filename) is None: filename += '.csv'
+    csv_stat = os.stat(filename)
+    return {"filename":os.path.abspath(filename), "size":csv_stat.st_size,
+            "mtime":csv_stat.st_mtime}
+
+
+def _csv_engine(filename=None):
+    """
+    CSV parser for a whole file: pyarrow's multithreaded reader if it is
+    installed, otherwise the default C parser.
+    """
+    if (filename.endswith(".csv") and 
+        importlib.util.find_spec("pyarrow") is not None):
+        return "pyarrow"
+    return "c"
+
+
+def _clean_retron_df(ret_df=None):
+    """
+    Clean and validate retron data read from a CSV file. See 
+    ``read_retron_csv()``.
+    
+    Every column is cleaned as a whole: leading and trailing blanks are 
+    stripped and blank values become null. Rows without a node ID are 
+    dropped. Node IDs that are not non-negative integers, node IDs repeated
+    within the data and values that do not match the property schema are 
+    all collected and raised together in a ``CSVValidationError``. Row 
+    numbers are taken from the index, so data read in chunks is only 
+    checked for repeats within each chunk.
+    """
+    # Drop "_id" if present (e.g., from backup file)
+    ret_df = ret_df.drop(columns="_id", errors="ignore")
+    
+    # Check node IDs
+    if "node" not in ret_df.columns:
+       raise MissingKeyError("There must be a \"node\" column.")
+    
+    # Strip leading and trailing blanks; blanks become null
+    ret_df = ret_df.apply(lambda col: col.str.strip() 
+                          if pd.api.types.is_string_dtype(col) or 
+                          pd.api.types.is_object_dtype(col) else col)
+    ret_df = ret_df.mask(ret_df == "")
+    ret_df = ret_df[ret_df['node'].notna()]
+    
+    # Collect every problem before raising
+    errors = []
+    def _report(prop, bad, error):
+        errors.append(pd.DataFrame({
+            "line":ret_df.index[bad] + 2, "node":ret_df['node'][bad].values,
+            "property":prop, "value":ret_df[prop][bad].values, 
+            "error":error}))
+    
+    _report("node", ~ret_df['node'].str.fullmatch(r"\d+").to_numpy(bool),
+            "node ID is not a non-negative integer")
+    _report("node", ret_df['node'].duplicated(keep=False).to_numpy(),
+            "node ID is repeated")
+    ret_out, bad_masks = _convert_schema(ret_df)
+    for prop, bad in bad_masks.items():
+        _report(prop, bad.to_numpy(), "value does not match the " + 
+                PROPERTY_SCHEMA[prop]['type'] + " schema")
+    
+    report = pd.concat(errors, ignore_index=True)
+    if len(report) > 0:
+        raise CSVValidationError(
+            report.sort_values(["line", "property"], ignore_index=True))
+    return ret_out
+    
+@_profiled
+def apply_schema(ret_df=None, schema=None):
+    """
+    Convert the columns of retron data to the types declared in the property
+    schema, e.g., "94" to 94 for an "int" property. Columns are converted 
+    as a whole, and undeclared properties are left as they are. Values that
+    cannot be converted, missing values of non-nullable properties and 
+    values outside of the allowed categories raise a ``SchemaError``.
+
+    Parameters
+    ----------
+    ret_df : ``pandas.DataFrame``
+        Retron data, e.g., from a CSV file
+    schema : ``dict``, optional
+        Property types. Default is ``PROPERTY_SCHEMA``.
+        
+    Returns
+    -------
+    pandas.DataFrame 
+        DataFrame with converted columns. Numeric columns use the nullable
+        "Int64" and "Float64" dtypes.
+
+    """
+    ret_conv, bad_masks = _convert_schema(ret_df, schema)
+    bad_props = {prop:list(ret_df[prop][bad].unique()[:5]) 
+                 for prop, bad in bad_masks.items()}
+    if len(bad_props) > 0:
+        raise SchemaError(bad_props)
+    return ret_conv
+
+
+def _convert_schema(ret_df=None, schema=None):
+    """
+    Convert the columns of retron data to their declared types. See 
+    ``apply_schema()``. Returns the converted DataFrame and, for each 
+    property with invalid values, a boolean Series marking them. Invalid 
+    numeric values are null in the converted DataFrame.
+    """
+    if schema is None:
+        schema = PROPERTY_SCHEMA
+    ret_df = ret_df.copy()
+    bad_masks = {}
+    for prop, spec in schema.items():
+        if prop not in ret_df:
+            continue
+        col = ret_df[prop]
+        if spec['type'] in ["int", "float"]:
+            conv = pd.to_numeric(col, errors="coerce")
+            bad = col.notna() & conv.isna()
+            if spec['type'] == "int":
+                bad |= conv.notna() & (conv % 1 != 0)
+                conv = conv.where(~bad).astype("Int64")
+            else:
+                conv = conv.astype("Float64")
+        else:
+            conv = col.where(col.isna(), col.astype(str))
+            bad = pd.Series(False, index=col.index)
+            if spec['type'] == "category" and "categories" in spec:
+                bad = conv.notna() & ~conv.isin(spec['categories'])
+        if not spec.get('nullable', True):
+            bad |= col.isna()
+        if bad.any():
+            bad_masks[prop] = bad
+        ret_df[prop] = conv
+    return ret_df, bad_masks
+
+
+@_profiled
+def migrate_property_types(rdb_handle=None, schema=None):
+    """
+    Convert the stored values of declared properties to their types, e.g., 
+    "94" to 94, in place on the server. One update per property is sent in a
+    single bulk write, so no retrons are downloaded. Blank values become 
+    null, and values that cannot be converted are kept and reported. 
+    Converted numeric properties can then be queried with comparison 
+    operators like {"$gt":50} and use indexes.
+    
+    These changes are not in the change log, so use 
+    ``sync_snapshot(full=True)`` afterwards if you keep a local snapshot.
+
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    schema : ``dict``, optional
+        Property types. Default is ``PROPERTY_SCHEMA``.
+        
+    Returns
+    -------
+    dict
+        Number of retrons left with unconverted (string) values, per property
+
+    """
+    if schema is None:
+        schema = PROPERTY_SCHEMA
+    to_types = {"int":"int", "float":"double"}
+    mig_props = [p for p, spec in schema.items() if spec['type'] in to_types]
+    mig_ops = []
+    for prop in mig_props:
+        val = {"$trim":{"input":{"$getField":prop}}}
+        conv = {"$convert":{"input":val, "to":to_types[schema[prop]['type']],
+                            "onError":{"$getField":prop}}}
+        mig_ops.append(pm.UpdateMany(
+            {prop:{"$type":"string"}},
+            [{"$replaceWith":{"$setField":{"field":prop, "input":"$$ROOT",
+                "value":{"$cond":[{"$eq":[val, ""]}, None, conv]}}}}]))
+    if len(mig_ops) > 0:
+        mig_obj = rdb_handle.bulk_write(mig_ops, ordered=False)
+        clear_query_cache(rdb_handle)
+        print("Converted property values in " + 
+              str(mig_obj.modified_count) + " updates.")
+    
+    mig_left = {p:rdb_handle.count_documents({p:{"$type":"string"}}) 
+                for p in mig_props}
+    for prop, n in mig_left.items():
+        if n > 0:
+            print(ansiRed.format("SchemaError")+": " + str(n) + 
+                  " retrons have \"" + prop + "\" values that could not be" +
+                  " converted.")
+    return mig_left
+
+
+def _apply_schema_dict(retron_dict=None, schema=None):
+    """
+    ``apply_schema()`` for a single retron dictionary.
+    """
+    ret_df = apply_schema(pd.DataFrame([retron_dict]), schema)
+    return _df_to_records(ret_df)[0]
+
+
+def _coerce_query_value(key=None, value=None, schema=None):
+    """
+    Convert a query value, or the values of a set of conditions, to the 
+    declared type of a numeric property. Values that cannot be converted are
+    left as they are.
+    """
+    if schema is None:
+        schema = PROPERTY_SCHEMA
+    if key not in schema or schema[key]['type'] not in ["int", "float"]:
+        return value
+    def conv(v):
+        if not isinstance(v, str):
+            return v
+        try:
+            v_num = float(v)
+        except ValueError:
+            return v
+        if schema[key]['type'] == "int" and v_num.is_integer():
+            return int(v_num)
+        return v_num
+    if isinstance(value, dict):
+        return {op:([conv(v) for v in val] if isinstance(val, list) 
+                    else conv(val)) for op, val in value.items()}
+    return conv(value)
+
+
+@_profiled
+def check_new_property(rdb_handle=None, props=None, new_property=False):
+    """
+    Check incoming properties against existing properties in retron database.
+    If new_property is False (default), then novel properties will be rejected.
+    
+    This check is intended to help protect against inserting typos and other
+    unintended property names into the database.
+    
+    Existing properties are looked up via ``get_properties()``, which is 
+    cached per collection.
+    
+    Parameters
+    ----------
+    rdb_handle : ``pymongo.Collection`` obj
+        A retron database collection object, e.g., the output of 
+        ``get_retronDB()``
+    props : ``set``
+        Incoming property names
+    new_property : ``bool``, optional
+        Whether to accept novel properties. Default is ``False``.  
+        
+    Returns
+    -------
+    None
+    
+    """
+    rdb_props = get_properties(rdb_handle)
+    radd_new = props.difference(rdb_props)
+    if len(radd_new) > 0 and not new_property:
+        raise UnrecognizedPropertyError(radd_new)
+
+
+def _restore_backup(directory=None, db_name=None, batch_size=1000, uri=None):
+    """
+    Restore a backup directory from ``backup_retronDB()``: apply the base and
+    each delta in order, with bulk writes.
+    """
+    with open(os.path.join(directory, "backup.json")) as f:
+        bak_manifest = json.load(f)
+    for bak_entry in bak_manifest['chain']:
+        bak_path = os.path.join(directory, bak_entry['file'])
+        if _sha256_file(bak_path) != bak_entry['sha256']:
+            raise ValueError ("Checksum of " + bak_path + " does not match" +
+                              " the backup manifest. The file may be corrupt.")
+    
+    rdb_handle = connect_retronDB(db_name, uri)
+    for bak_entry in bak_manifest['chain']:
+        bak_path = os.path.join(directory, bak_entry['file'])
+        if len(bak_entry['deleted']) > 0:
+            rdb_handle.delete_many({"node":{"$in":bak_entry['deleted']}})
+            _after_write(rdb_handle, bak_entry['deleted'], deleted=True)
+        for batch in _cursor_batches(_iter_export(bak_path, "bson", "gzip"), 
+                                     batch_size):
+            # Drop retrons re-added under a new "_id" before replacing by "_id"
+            rdb_handle.delete_many({"node":{"$in":[r['node'] for r in batch]},
+                                    "_id":{"$nin":[r['_id'] for r in batch]}})
+            rdb_handle.bulk_write([pm.ReplaceOne({"_id":r['_id']}, r, 
+                                                 upsert=True) for r in batch],
+                                  ordered=False)
+            _after_write(rdb_handle, [r['node'] for r in batch],
+                         set().union(*(r.keys() for r in batch)))
+        print("Applied " + bak_entry['file'] + ".")
+    return rdb_handle
+
+
+def _retron_hash(retron_dict=None):
+    """
+    Content hash of a retron, independent of property order.
+    """
+    return hashlib.blake2b(bson.encode(dict(sorted(retron_dict.items()))),
+                           digest_size=16).hexdigest()
+
+
+def _export_format(filename=None, format=None, compression=None):
+    """
+    The format and compression of a saved retron database, as given or 
+    based on the **filename** extension.
+    """
+    ext_compression = {".gz":"gzip", ".zst":"zstd"}
+    ext_format = {".csv":"csv", ".jsonl":"jsonl", ".parquet":"parquet",
+                  ".bson":"bson"}
+    base, ext = os.path.splitext(filename)
+    if ext in ext_compression:
+        if compression is None:
+            compression = ext_compression[ext]
+        base, ext = os.path.splitext(base)
+    if format is None:
+        format = ext_format.get(ext, "csv")
+    if format not in ext_format.values():
+        raise ValueError ('format must be "csv", "jsonl", "parquet" or "bson"')
+    return format, compression
+
+
+def _open_export(filename=None, mode="rb", compression=None):
+    """
+    Open a (compressed) binary file for ``save_retronDB()`` or 
+    ``restore_retronDB()``.
+    """
+    if compression is None:
+        return open(filename, mode)
+    if compression == "gzip":
+        return gzip.open(filename, mode)
+    if compression == "zstd":
+        zstd = _require("zstandard", 'compression="zstd"')
+        if mode == "wb":
+            return zstd.ZstdCompressor().stream_writer(open(filename, "wb"))
+        return zstd.ZstdDecompressor().stream_reader(open(filename, "rb"))
+    raise ValueError ('compression must be "gzip", "zstd" or None')
+
+
+def _iter_export(filename=None, format="jsonl", compression=None):
+    """
+    Iterate over the retrons saved in a JSON Lines, BSON or Parquet file.
+    """
+    if format == "parquet":
+        pq = _require("pyarrow.parquet", 'format="parquet"')
+        for batch in pq.ParquetFile(filename).iter_batches():
+            for r in batch.to_pylist():
+                r = {p:v for p, v in r.items() if v is not None}
+                if bson.ObjectId.is_valid(r.get('_id')):
+                    r['_id'] = bson.ObjectId(r['_id'])
+                yield r
+        return
+    with _open_export(filename, "rb", compression) as f:
+        if format == "bson":
+            yield from bson.decode_file_iter(f)
+        else:
+            for line in io.TextIOWrapper(f, encoding="utf-8"):
+                if line.strip():
+                    yield json_util.loads(line)
+
+
+def _arrow_schema(rdb_cols=None):
+    """
+    Arrow schema for saving retrons: "_id" and undeclared properties as 
+    strings, declared properties as their types (see ``PROPERTY_SCHEMA``).
+    """
+    pa = _require("pyarrow", 'format="parquet"')
+    pa_types = {"int":pa.int64(), "float":pa.float64()}
+    return pa.schema([(c, pa_types.get(PROPERTY_SCHEMA.get(c, {})
+                                       .get('type'), pa.string())) 
+                      for c in rdb_cols])
+
+
+def _df_to_arrow(rdb_df=None, pa_schema=None):
+    """
+    Convert a batch of retrons to an Arrow table with a fixed schema.
+    """
+    pa = _require("pyarrow", 'format="parquet"')
+    rdb_df = rdb_df.copy()
+    for c in pa_schema.names:
+        if pa_schema.field(c).type == pa.string():
+            rdb_df[c] = rdb_df[c].where(rdb_df[c].isna(), 
+                                        rdb_df[c].astype(str))
+        else:
+            rdb_df[c] = pd.to_numeric(rdb_df[c], errors="coerce")
+    return pa.Table.from_pandas(rdb_df, schema=pa_schema, 
+                                preserve_index=False)
+
+
+def _sha256_file(filename=None):
+    """
+    SHA-256 checksum of a file, read in blocks.
+    """
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _write_json_atomic(filename=None, obj=None):
+    """
+    Write **obj** as JSON, replacing **filename** only once fully written.
+    """
+    tmp_name = filename + ".tmp"
+    with open(tmp_name, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_name, filename)
+
+
+def _retrondb_uri(uri=None):
+    """
+    The MongoDB URI for ``connect_retronDB()``: **uri** if given, else
+    RETRONDB_URI, else the retronDB cluster with credentials from the
+    environment (or a .env file) or prompted for.
+    """
+    # Load config from a .env file or prompt for entries
+    dotenv.load_dotenv(verbose=True)
+    if uri is None:
+        uri = os.environ.get('RETRONDB_URI')
+    if uri is not None:
+        return uri
+    try:
+        RETRONDB_USR = os.environ['RETRONDB_USR']
+    except KeyError:
+        RETRONDB_USR = input("Enter username:")
+    try:
+        RETRONDB_PWD = os.environ['RETRONDB_PWD']
+    except KeyError:
+        RETRONDB_PWD = getpass.getpass(prompt="Enter password:") 
+
+    # Construct MongoClient URI    
+    return str("mongodb+srv://" +
+    RETRONDB_USR + ":" +
+    RETRONDB_PWD +
+    "@cluster0.uuutrha.mongodb.net/?retryWrites=true&w=majority")
+
+
+def _after_write(rdb_handle=None, nodes=None, props=None, deleted=False):
+    """
+    Bookkeeping after retrons are added, updated (**props** written) or 
+    removed (**deleted**): keeps the property catalog, query cache, change 
+    log and k-mer index current.
+    """
+    ncrna_changed = _note_write(rdb_handle, props, deleted)
+    if nodes:
+        _log_changes(rdb_handle, nodes, deleted)
+        if ncrna_changed:
+            _update_kmer_index(rdb_handle, nodes, deleted)
+
+
+def _note_write(rdb_handle=None, props=None, deleted=False):
+    """
+    The in-process part of ``_after_write()``: clears cached query results 
+    and keeps the property catalog current. Returns whether ncRNA sequences
+    may have changed, i.e., the k-mer index needs updating.
+    """
+    clear_query_cache(rdb_handle)
+    if deleted:
+        clear_property_cache(rdb_handle)
+    elif props is not None:
+        _catalog_add(rdb_handle, props)
+    return deleted or props is None or "ncrna" in props
+
+
+def _kmer_index_k(rdb_handle=None):
+    """
+    The k of the k-mer index of a retron database, or None if there is no 
+    index. See ``_cached_kmer_k()``.
+    """
+    rdb_key = _handle_key(rdb_handle)
+    found, k = _cached_kmer_k(rdb_key)
+    if not found:
+        rdb_kmers = rdb_handle.database[rdb_handle.name + KMERS_SUFFIX]
+        kmer_meta = rdb_kmers.find_one({"_id":"_meta"})
+        k = None if kmer_meta is None else kmer_meta['k']
+        _kmer_k[rdb_key] = (k, time.monotonic())
+    return k
+
+
+def _cached_kmer_k(rdb_key=None):
+    """
+    Whether the k of a k-mer index is cached, and the k (None if there is no
+    index). An index is looked up once per process, but a missing one again
+    after ``KMER_RECHECK`` seconds.
+    """
+    if rdb_key not in _kmer_k:
+        return False, None
+    k, checked = _kmer_k[rdb_key]
+    if k is None and time.monotonic() - checked > KMER_RECHECK:
+        return False, None
+    return True, k
+
+
+def _update_kmer_index(rdb_handle=None, nodes=None, deleted=False):
+    """
+    Re-index the ncRNA sequences of added or updated retrons, or drop removed
+    retrons, if there is a k-mer index.
+    """
+    k = _kmer_index_k(rdb_handle)
+    if k is None:
+        return
+    rdb_kmers = rdb_handle.database[rdb_handle.name + KMERS_SUFFIX]
+    nodes = [str(n) for n in set(nodes)]
+    if deleted:
+        rdb_kmers.delete_many({"_id":{"$in":nodes}})
+        return
+    seqs = {r['node']:r.get('ncrna') for r in rdb_handle.find(
+        {"node":{"$in":nodes}}, {"_id":0, "node":1, "ncrna":1})}
+    rdb_kmers.bulk_write(_kmer_ops(nodes, seqs, k), ordered=False)
+
+
+def _kmer_ops(nodes=None, seqs=None, k=8):
+    """
+    Bulk writes re-indexing the ncRNA sequences (**seqs**, by node ID) of 
+    **nodes** in a k-mer index. Nodes without a sequence are dropped.
+    """
+    return [pm.ReplaceOne({"_id":n}, {"kmers":_encode_kmers(seqs[n], k)
+                                      .tolist()}, upsert=True)
+            if isinstance(seqs.get(n), str) else pm.DeleteOne({"_id":n})
+            for n in nodes]
+
+
+def _encode_kmers(seq=None, k=8):
+    """
+    The distinct k-mers of a nucleotide sequence, 2-bit packed as int64. 
+    K-mers with other characters than A, C, G, T or U are skipped.
+    """
+    codes = _nt_codes()[np.frombuffer(seq.encode("ascii", "replace"), 
+                                      dtype=np.uint8)]
+    if len(codes) < k:
+        return np.empty(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    windows = windows[(windows < 4).all(axis=1)].astype(np.int64)
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.int64)
+    return np.unique((windows << shifts).sum(axis=1))
+
+
+@functools.lru_cache(maxsize=None)
+def _nt_codes():
+    """
+    Lookup table of the 2-bit code of each byte (see ``_NT_BASES``).
+    """
+    codes = np.full(256, 4, dtype=np.uint8)
+    for i, nts in enumerate(_NT_BASES):
+        codes[[ord(nt) for nt in nts]] = i
+    return codes
+
+
+def _remove_retrons(rdb_handle=None, rdb_filter=None, batch_size=1000):
+    """
+    Archive the retrons matching a filter in the trash collection and delete
+    them. See ``remove_retrons_by()``. Returns the removed retrons as a 
+    DataFrame, with the removal ID in ``attrs['removal']``.
+    """
+    rdb_trash = _trash_handle(rdb_handle)
+    removal = bson.ObjectId()
+    removed = datetime.datetime.now(datetime.timezone.utc)
+    def archive_and_delete(session=None):
+        # Read in the transaction, so the trash holds what is deleted
+        batch = list(rdb_handle.find(rdb_filter, limit=batch_size, 
+                                     session=session))
+        if len(batch) > 0:
+            rdb_trash.insert_many(_trash_entries(batch, removal, removed),
+                                  session=session)
+            rdb_handle.delete_many({"_id":{"$in":[r['_id'] for r in batch]}},
+                                   session=session)
+        return batch
+    
+    gone = []
+    while True:
+        batch = _in_transaction(rdb_handle, archive_and_delete)
+        gone.extend(batch)
+        if len(batch) > 0:
+            _after_write(rdb_handle, [r['node'] for r in batch if 'node' in r],
+                         deleted=True)
+        if len(batch) < batch_size:
+            break
+    gone = format_result(gone, "df")
+    gone.attrs['removal'] = str(removal)
+    return gone
+
+
+def _trash_entries(retrons=None, removal=None, removed=None):
+    """
+    Trash collection entries archiving removed retrons, for one removal.
+    """
+    return [{"_id":bson.ObjectId(), "node":r.get('node'), "removal":removal,
+             "removed":removed, "retron":r} for r in retrons]
+
+
+def _in_transaction(rdb_handle=None, fn=None):
+    """
+    Run **fn(session)** in a transaction on the client of a collection, or 
+    **fn(None)** if it does not support sessions or transactions, e.g., a 
+    standalone server, mongomock or a local database.
+    """
+    client = rdb_handle.database.client
+    if not hasattr(client, "start_session"):
+        return fn(None)
+    try:
+        session = client.start_session()
+    except NotImplementedError:
+        # No sessions, e.g., mongomock
+        return fn(None)
+    try:
+        with session:
+            return session.with_transaction(fn)
+    except pm.errors.OperationFailure as e:
+        # IllegalOperation: transactions need a replica set or mongos
+        if e.code != 20:
+            raise
+    return fn(None)
+
+
+def _trash_handle(rdb_handle=None):
+    """
+    The trash collection of a retron database. See ``TRASH_SUFFIX``.
+    """
+    rdb_trash = rdb_handle.database[rdb_handle.name + TRASH_SUFFIX]
+    if _handle_key(rdb_trash) not in _trash_indexed:
+        rdb_trash.create_indexes(_index_plan(TRASH_INDEX_SPEC)[0])
+        _trash_indexed.add(_handle_key(rdb_trash))
+    return rdb_trash
+
+
+def _changes_handle(rdb_handle=None):
+    """
+    The change log collection of a retron database. See ``CHANGES_SUFFIX``.
+    """
+    rdb_log = rdb_handle.database[rdb_handle.name + CHANGES_SUFFIX]
+    if _handle_key(rdb_log) not in _changes_indexed:
+        rdb_log.create_indexes(_index_plan(CHANGES_INDEX_SPEC)[0])
+        _changes_indexed.add(_handle_key(rdb_log))
+    return rdb_log
+
+
+def _log_changes(rdb_handle=None, nodes=None, deleted=False):
+    """
+    Stamp **nodes** with the server time in the change log. Removed nodes 
+    are kept as tombstones.
+    """
+    _changes_handle(rdb_handle).bulk_write(_change_log_ops(nodes, deleted), 
+                                           ordered=False)
+
+
+def _change_log_ops(nodes=None, deleted=False):
+    """
+    Bulk writes stamping **nodes** with the server time in the change log.
+    """
+    return [pm.UpdateOne({"node":str(n)},
+                         {"$currentDate":{"modified":True},
+                          "$set":{"deleted":deleted}}, upsert=True)
+            for n in set(nodes)]
+
+
+def _properties_pipeline():
+    """
+    Aggregation pipeline listing the property names used by any retron. See 
+    ``get_properties()``.
+    """
+    return [
+        {"$project": {"kv": {"$objectToArray": "$$ROOT"}}},
+        {"$unwind": "$kv"},
+        {"$group": {"_id": "$kv.k"}}
+        ]
+
+
+def _index_plan(spec=None, rdb_inds=()):
+    """
+    Reconcile declared indexes (default ``INDEX_SPEC``) with the existing 
+    ones, e.g., from ``list_indexes()``. Returns the ``pymongo.IndexModel`` 
+    objs to create and the names of the undeclared indexes, and reports 
+    indexes with conflicting options. See ``ensure_indexes()``.
+    """
+    if spec is None:
+        spec = INDEX_SPEC
+    rdb_inds = {tuple(son.SON(ind['key']).items()):ind for ind in rdb_inds}
+    
+    ind_models = []
+    for ind_spec in spec:
+        ind_keys = tuple((k, d) for k, d in ind_spec['keys'])
+        ind_opts = {o:v for o, v in ind_spec.items() if o != "keys"}
+        if ind_keys not in rdb_inds:
+            ind_models.append(pm.IndexModel(list(ind_keys), **ind_opts))
+        elif any(rdb_inds[ind_keys].get(o) != v for o, v in ind_opts.items()
+                 if o != "name"):
+            print(ansiRed.format("IndexConflict")+": Index \"" + 
+                  rdb_inds[ind_keys]['name'] + "\" does not have the" +
+                  " declared options " + str(ind_opts) + ". Drop it to" +
+                  " have it recreated.")
+    
+    spec_keys = set(tuple((k, d) for k, d in ind_spec['keys']) 
+                    for ind_spec in spec)
+    ind_extra = [ind['name'] for ind_keys, ind in rdb_inds.items()
+                 if ind['name'] != "_id_" and ind_keys not in spec_keys]
+    return ind_models, ind_extra
+
+
+def _arrow_safe(ret_df=None):
+    """
+    Cast object columns that mix value types (e.g., str and int) to str, so 
+    a DataFrame can be converted to Arrow.
+    """
+    for col in ret_df.columns[ret_df.dtypes == object]:
+        vals = ret_df[col].dropna()
+        if vals.map(type).nunique() > 1:
+            ret_df[col] = ret_df[col].where(ret_df[col].isna(), 
+                                            ret_df[col].astype(str))
+    return ret_df
+
+
+def _require(module_name=None, purpose=None):
+    """
+    Import an optional dependency, with a helpful error if it is missing.
+    """
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        raise ImportError("The " + module_name.split(".")[0] + 
+                          " package is required for " + purpose + 
+                          ". Try: pip install " + module_name.split(".")[0])
+
+
+def _handle_key(rdb_handle=None):
+    """
+    Key identifying a retron database collection in the in-process caches.
+    """
+    return rdb_handle.full_name
+
+
+def _catalog_add(rdb_handle=None, props=None):
+    """
+    Add newly written property names to a cached property catalog, if any.
+    """
+    rdb_key = _handle_key(rdb_handle)
+    if rdb_key in _property_catalog:
+        _property_catalog[rdb_key] |= set(props)
+        
+
+@_profiled
+def format_result(result=None, format="df"):
     """
     Transform one or more retronDB query results into useful formats. Takes 
-    either a singular dictionary result or ``pymongo.Cursor`` results as input. 
-    Returns eiter raw, JSON, dictionary or ``pandas.DataFrame`` (default).
+    either a singular dictionary result, a list of dictionaries or 
+    ``pymongo.Cursor`` results as input. Cursors are consumed in a single 
+    pass. Returns eiter raw, JSON, dictionary or ``pandas.DataFrame`` 
+    (default).
 
     Parameters
     ----------
-    result : ``dict`` or ``pymongo.Cursor``
+    result : ``dict``, ``list`` or ``pymongo.Cursor``
         Represents the result of pymongo.find() or .find_one()
     format : ``str``, optional
         Either "raw", "json", "dict", or "df" (default)
@@ -665,20 +3122,311 @@ def format_result(result=None, format="df"):
     if format == "json":
         return json_util.dumps(result)
     elif format == "dict":
-        return json.loads(json_util.dumps(result))
-    else: #DataFrame. This one is finicky
-        # Check: dict or Cursor?
-        res = None
+        # Same values as a JSON round trip, e.g., {"$oid":...} for ObjectIds
+        if isinstance(result, dict) or result is None:
+            return _json_value(result)
+        return [_json_value(r) for r in result]
+    else: #DataFrame
+        # Check: dict, missing or Cursor? Cursors are read once.
         if isinstance(result, dict):
             res = [result]
+        elif result is None:
+            res = []
         else:
-            # Check: single or multiple results
-            if len(list(result.clone())) < 2:
-                res = [result.clone()][0]
-            else:
-                res = list(result.clone())
+            res = list(result)
         return pd.DataFrame(res)
 
+
+def _json_value(value=None):
+    """
+    A BSON value as ``json.loads(json_util.dumps(value))`` returns it, without
+    serializing plain values to text and back.
+    """
+    v_type = type(value)
+    if value is None or v_type is str or v_type is int or v_type is bool:
+        return value
+    if v_type is float and math.isfinite(value):
+        return value
+    if v_type is dict:
+        return {k:_json_value(v) for k, v in value.items()}
+    if v_type is list:
+        return [_json_value(v) for v in value]
+    if v_type is bson.ObjectId:
+        return {"$oid":str(value)}
+    # Dates, NaN, Int64, binary, etc. as extended JSON
+    return json.loads(json_util.dumps(value))
+
+
+def _df_to_records(ret_df=None):
+    """
+    DataFrame rows as BSON-ready dictionaries, column by column. Missing 
+    values are None and numpy scalars Python values, as from 
+    ``json.loads(ret_df.to_json(orient='records'))`` but without the text
+    round trip (or its rounding of floats).
+    """
+    cols = []
+    for c in ret_df.columns:
+        col = ret_df[c]
+        vals = col.tolist()
+        if col.hasnans:
+            vals = [None if m else v for v, m in zip(vals, col.isna().tolist())]
+        cols.append(vals)
+    names = list(ret_df.columns)
+    return [dict(zip(names, row)) for row in zip(*cols)]
+
+
+def _cached_query(rdb_handle=None, query=None, format="df", run=None):
+    """
+    The result of **run()**, from the query cache if enabled and a result of
+    the same **query** and **format** is cached and fresh. See 
+    ``enable_query_cache()``.
+    """
+    if _query_cache_stats['max_size'] <= 0:
+        return run()
+    key = (_handle_key(rdb_handle), json_util.dumps(query), format.lower())
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        ttl = _query_cache_stats['ttl']
+        if entry is not None and (ttl is None or 
+                                  time.monotonic() - entry[0] < ttl):
+            _query_cache.move_to_end(key)
+            _query_cache_stats['hits'] += 1
+            return _copy_result(entry[1])
+        if entry is not None:
+            del _query_cache[key]
+            _query_cache_stats['evictions'] += 1
+        _query_cache_stats['misses'] += 1
+        generation = _query_cache_stats['generation']
+    
+    res = run()
+    with _query_cache_lock:
+        if generation == _query_cache_stats['generation']:
+            _query_cache[key] = (time.monotonic(), _copy_result(res))
+            while len(_query_cache) > _query_cache_stats['max_size']:
+                _query_cache.popitem(last=False)
+                _query_cache_stats['evictions'] += 1
+    return res
+
+
+def _copy_result(res=None):
+    """
+    A copy of a query result that can be modified without changing the 
+    cached one. JSON strings are immutable and not copied.
+    """
+    if isinstance(res, str):
+        return res
+    if isinstance(res, (list, dict)):
+        return copy.deepcopy(res)
+    return res.copy()
+
+
+def _command_profiler():
+    """
+    A new command listener for a pooled client (see ``profile()``). The 
+    listener class is made on first use, so pymongo is only imported once a
+    client is created.
+    """
+    return _command_profiler_class()()
+
+
+@functools.lru_cache(maxsize=None)
+def _command_profiler_class():
+    """
+    The ``_CommandProfiler`` pymongo CommandListener class.
+    """
+    return type("CommandProfiler", 
+                (_CommandProfiler, pm.monitoring.CommandListener), {})
+
+
+def _find_args(filter=None, fields=None, exclude=None, sort=None, limit=None,
+               after=None):
+    """
+    Keyword arguments for ``pymongo.Collection.find()`` implementing the 
+    **fields**, **exclude**, **sort**, **limit** and **after** parameters of
+    the get functions.
+    """
+    if fields is not None and exclude is not None:
+        raise ValueError ("Use either fields or exclude, not both.")
+    find_args = {"filter": {} if filter is None else filter}
+    
+    # Projection
+    if fields is not None:
+        find_args['projection'] = {"_id":0}
+        find_args['projection'].update((str(f), 1) for f in fields)
+    elif exclude is not None:
+        find_args['projection'] = {str(e):0 for e in exclude}
+    
+    # Sort order
+    if isinstance(sort, str):
+        sort = [sort]
+    if sort is not None:
+        sort = [(s[1:], pm.DESCENDING) if s.startswith("-") else 
+                (s, pm.ASCENDING) for s in sort]
+    
+    # Keyset pagination on node
+    if after is not None:
+        if sort is not None and sort != [("node", pm.ASCENDING)]:
+            raise ValueError ("Pages are sorted by node; after cannot be" +
+                              " combined with another sort order.")
+        sort = [("node", pm.ASCENDING)]
+        find_args['filter'] = {"$and":[find_args['filter'], 
+                                       {"node":{"$gt":str(after)}}]}
+    if sort is not None:
+        find_args['sort'] = sort
+    if limit is not None:
+        find_args['limit'] = int(limit)
+    return find_args
+
+
+def _cursor_batches(cursor=None, batch_size=1000):
+    """
+    Read a ``pymongo.Cursor`` (or any iterable) once, in lists of up to 
+    **batch_size** results.
+    """
+    while True:
+        batch = list(itertools.islice(cursor, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def _collect_batches(batches=None, format="df"):
+    """
+    Combine the batches from ``iter_retrons()`` into a single result of the 
+    same format.
+    """
+    format = format.lower()
+    batches = list(batches)
+    if format == "df":
+        if len(batches) == 0:
+            return pd.DataFrame()
+        return pd.concat(batches, ignore_index=True)
+    elif format == "dict":
+        return list(itertools.chain.from_iterable(batches))
+    else: # JSON arrays; join their contents
+        return "[" + ", ".join(b[1:-1] for b in batches if b != "[]") + "]"
+
+###############################################################################
+# COMMAND LINE
+def main(argv=None):
+    """
+    Command line interface, e.g., ``python -m retrondb get 28 --fields 
+    node,ncrna``. See ``python -m retrondb --help`` for the subcommands.
+    Results are written to standard output and messages to standard error.
+
+    Parameters
+    ----------
+    argv : ``list`` of ``str``, optional
+        Arguments. Default is ``sys.argv[1:]``.
+        
+    Returns
+    -------
+    int
+        Exit status
+
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="retrondb", description="Query and maintain a retron database.")
+    parser.add_argument("--db", default="retronDB", 
+                        help="database name (default: %(default)s)")
+    parser.add_argument("--uri", help="MongoDB connection string (default: " +
+                        "RETRONDB_URI or the retronDB cluster)")
+    cmds = parser.add_subparsers(dest="command", required=True)
+    
+    def add_output_args(cmd):
+        cmd.add_argument("--fields", help="comma-separated properties to " +
+                         "return, e.g., node,ncrna")
+        cmd.add_argument("--exclude", help="comma-separated properties " +
+                         "to leave out")
+        cmd.add_argument("--format", choices=["json", "csv"], default="json",
+                         help="output format (default: %(default)s)")
+    
+    cmd = cmds.add_parser("get", help="get retrons by node ID")
+    cmd.add_argument("nodes", nargs="+", help="node IDs")
+    add_output_args(cmd)
+    cmd = cmds.add_parser("query", help="get retrons by a property value")
+    cmd.add_argument("key", help="property, e.g., \"retron (sub)b\"")
+    cmd.add_argument("value", help="value, or conditions as JSON, e.g., " +
+                     "'{\"$gt\":50}'")
+    add_output_args(cmd)
+    cmd.add_argument("--sort", help="comma-separated properties to sort " +
+                     "by, each prefixed with - for descending order")
+    cmd.add_argument("--limit", type=int, help="maximum number of retrons")
+    cmd = cmds.add_parser("import", help="add retrons from a CSV file")
+    cmd.add_argument("filename")
+    cmd.add_argument("--new-property", action="store_true",
+                     help="accept novel properties")
+    cmd.add_argument("--chunksize", type=int, help="rows per chunk")
+    cmd = cmds.add_parser("update", help="update retrons from a CSV file")
+    cmd.add_argument("filename")
+    cmd.add_argument("--new-property", action="store_true",
+                     help="accept novel properties")
+    cmd.add_argument("--add", action="store_true", 
+                     help="add retrons not in the database")
+    cmd.add_argument("--diff", action="store_true",
+                     help="only send changed properties")
+    cmd.add_argument("--dry-run", action="store_true",
+                     help="only report the changes")
+    cmd = cmds.add_parser("export", help="save the database to a file")
+    cmd.add_argument("filename")
+    cmd.add_argument("--overwrite", action="store_true")
+    cmd.add_argument("--format", choices=["csv", "jsonl", "parquet", "bson"],
+                     help="file format (default: from the file extension)")
+    cmd.add_argument("--compression", help="e.g., gzip")
+    cmd = cmds.add_parser("summarize", help="summarize retron properties")
+    cmd.add_argument("properties", nargs="*", help="properties to " +
+                     "summarize (default: all)")
+    cmd.add_argument("--top", type=int, default=20,
+                     help="most frequent values to report (default: 20)")
+    args = parser.parse_args(argv)
+    
+    def split_arg(arg):
+        return None if arg is None else [a.strip() for a in arg.split(",")]
+    
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        rdb_handle = connect_retronDB(args.db, uri=args.uri)
+        if rdb_handle is None:
+            return 1
+        
+        if args.command in ["get", "query"]:
+            rget_format = "df" if args.format == "csv" else "json"
+            if args.command == "get":
+                res = get_retrons(rdb_handle, args.nodes, rget_format,
+                                  split_arg(args.fields), 
+                                  split_arg(args.exclude))
+            else:
+                value = args.value
+                if value.startswith(("{", "[")):
+                    value = json.loads(value)
+                res = get_retrons_by(rdb_handle, args.key, value, rget_format,
+                                     split_arg(args.fields), 
+                                     split_arg(args.exclude), 
+                                     split_arg(args.sort), args.limit)
+            res = res.to_csv(index=False) if args.format == "csv" else res
+        elif args.command == "import":
+            res = add_retrons_by_csv(rdb_handle, args.filename, 
+                                     args.new_property, args.chunksize)
+        elif args.command == "update":
+            res = update_retrons_by_csv(rdb_handle, args.filename, 
+                                        args.new_property, args.add, 
+                                        diff=args.diff, dry_run=args.dry_run)
+        elif args.command == "export":
+            res = save_retronDB(rdb_handle, args.filename, args.overwrite,
+                                args.format, args.compression)
+        else:
+            res = summarize_retrons(rdb_handle, args.properties or None,
+                                    args.top)['summary']
+        
+        if res is not None and not isinstance(res, str): # DataFrame
+            res = res.to_csv(index=False)
+    
+    if res is not None:
+        out.write(res if res.endswith("\n") else res + "\n")
+    return 0
+
+
 ###############
 # CLASSES
 
@@ -699,6 +3447,76 @@ class UnrecognizedPropertyError(ValueError):
         self.message += "\nDouble check your property names or consider setting new_property=True"
         super().__init__(self.message)
         
+class SchemaError(ValueError):
+    '''When incoming retron data does not match the declared property types'''
+    def __init__(self, bad_props, message='Failed to add or update retron. '+
+                  "\nOne or more property values do not match the schema:\n\n"):
+        self.message = message
+        for p, vals in bad_props.items():
+            self.message += "\t"+p+": "+", ".join(str(v) for v in vals)+"\n"
+        self.message += "\nDouble check your values or see PROPERTY_SCHEMA"
+        super().__init__(self.message)
+        
+class CSVValidationError(ValueError):
+    '''When a retron CSV file has invalid node IDs or values'''
+    def __init__(self, report, message='Failed to read retron CSV file. '+
+                  "\nOne or more problems detected:\n\n"):
+        self.report = report
+        self.message = message
+        for r in report.head(20).itertuples():
+            self.message += ("\tline "+str(r.line)+", "+r.property+" \""+
+                             str(r.value)+"\": "+r.error+"\n")
+        if len(report) > 20:
+            self.message += "\t... and "+str(len(report) - 20)+" more\n"
+        self.message += "\nSee the report attribute of this error for all of them"
+        super().__init__(self.message)
+        
+class _CommandProfiler:
+    '''Records the commands sent by a client in the active profile() reports.
+    Mixed into a pymongo CommandListener by _command_profiler().'''
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        if _profiles:
+            self.pending[(event.connection_id, event.request_id)] = (
+                _profiled_call.get() or "(other)", 
+                len(bson.encode(event.command)))
+
+    def succeeded(self, event):
+        self._record(event, event.reply)
+
+    def failed(self, event):
+        self._record(event, None)
+
+    def _record(self, event, reply):
+        sent = self.pending.pop((event.connection_id, event.request_id), None)
+        if sent is None:
+            return
+        name, bytes_sent = sent
+        cursor = (reply or {}).get('cursor', {})
+        retrons = len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+        bytes_received = len(bson.encode(reply)) if reply is not None else 0
+        with _profile_lock:
+            for report in _profiles:
+                self._add(report, name, event, reply is None, retrons, 
+                          bytes_sent, bytes_received)
+
+    def _add(self, report, name, event, failed, retrons, bytes_sent, 
+             bytes_received):
+        cmds = _profile_entry(report, name)['commands']
+        if event.command_name not in cmds:
+            cmds[event.command_name] = {
+                "count":0, "command_seconds":0.0, "failed":0, 
+                "retrons":0, "bytes_sent":0, "bytes_received":0}
+        stats = cmds[event.command_name]
+        stats['count'] += 1
+        stats['command_seconds'] += event.duration_micros / 1e6
+        stats['failed'] += failed
+        stats['retrons'] += retrons
+        stats['bytes_sent'] += bytes_sent
+        stats['bytes_received'] += bytes_received
+        
 class ProtectedFileError(ValueError):
     '''When a file already exists. Overwrite is not allowed.'''
     def __init__(self, message="This file already exists and cannot be" +
@@ -707,3 +3525,6 @@ class ProtectedFileError(ValueError):
         self.message = message
         super().__init__(self.message)
 
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,610 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The retrondb_aio module of asyncio equivalents for the retrondb functions,
+for issuing many independent lookups concurrently, e.g., from a web app.
+
+Functions take the same parameters, apply the same validation and return the
+same formats as their counterparts in ``retrondb``, but must be awaited. The
+**rdb_handle** is a ``pymongo.asynchronous.collection.AsyncCollection`` obj
+returned by ``connect_retronDB()`` in this module. Requires pymongo 4.10+.
+
+Usage: import retrondb_aio as ardb
+
+Created on Mon Oct 12 10:00:00 2026
+@author: alexpico
+"""
+
+import pymongo as pm
+import bson
+import asyncio
+import datetime
+import time
+import retrondb as rdb
+from retrondb import (MissingKeyError, UnrecognizedPropertyError,
+                      ansiRed, ansiGreen)
+
+#CACHES
+# Pooled AsyncMongoClients, keyed by URI, pool options and event loop
+_clients = {}
+
+
+###############################################################################
+# GENERAL FUNCTIONS
+async def connect_retronDB(db_name='retronDB', uri=None, max_pool_size=100,
+                           timeout_ms=20000):
+    """
+    Connect to a retron database. See ``retrondb.connect_retronDB()``.
+
+    Clients are pooled per event loop, so connecting again from the same
+    loop reuses the existing client and its connections.
+
+    Parameters
+    ----------
+    db_name : ``str``, optional
+        Name of the database to connect to, e.g., 'sandbox'. Default is the
+        official 'retronDB' database.
+    uri : ``str``, optional
+        A MongoDB connection string to use instead of the retronDB cluster.
+        Default is the RETRONDB_URI environment variable, if set.
+    max_pool_size : ``int``, optional
+        Maximum number of connections in the client's pool. Default is 100.
+    timeout_ms : ``int``, optional
+        Milliseconds to wait for a server or connection before giving up.
+        Default is 20000.
+
+    Returns
+    -------
+    AsyncCollection obj
+        A retron database collection object intended to be used as the
+        **rdb_handle** parameter in other functions of this module.
+
+    """
+    uri = rdb._retrondb_uri(uri)
+    client_key = (uri, max_pool_size, timeout_ms,
+                  id(asyncio.get_running_loop()))
+    client = _clients.get(client_key)
+    if client is None:
+        client = pm.AsyncMongoClient(uri, maxPoolSize=max_pool_size,
+                                     serverSelectionTimeoutMS=timeout_ms,
+                                     connectTimeoutMS=timeout_ms)
+        _clients[client_key] = client
+
+    db = client[db_name]
+    try:
+        await db.list_collection_names()
+    except:
+        print("\n" + ansiRed.format("Error")+": Failed to connect to " +
+              db_name + ". Check your username and password (or .env file).\n")
+    else:
+        print("\n" + ansiGreen.format("Success")+": Connected to "+
+              db_name + " with about " +
+              str(await db['retrons'].estimated_document_count()) +
+              " retrons\n" )
+        # Confirm indexes, once per process; create if not. Read-only users 
+        # cannot, so try again on the next connect.
+        if rdb._handle_key(db['retrons']) not in rdb._indexes_verified:
+            try:
+                await ensure_indexes(db['retrons'])
+            except pm.errors.OperationFailure as e:
+                print(ansiRed.format("Warning")+": Could not confirm the" +
+                      " indexes of " + db_name + ".\n", e)
+        return db['retrons']
+
+
+async def ensure_indexes(rdb_handle=None, spec=None, drop=False):
+    """
+    Reconcile the indexes of a retron database with a declared list of 
+    indexes. See ``retrondb.ensure_indexes()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    spec : ``list`` of ``dict``, optional
+        Declared indexes. Default is ``retrondb.INDEX_SPEC``.
+    drop : ``bool``, optional
+        Whether to also drop indexes that are not declared (other than 
+        "_id"). Default is ``False``.
+
+    Returns
+    -------
+    list
+        Names of the created indexes
+
+    """
+    res = await rdb_handle.list_indexes()
+    ind_models, ind_extra = rdb._index_plan(spec, await res.to_list(None))
+    ind_names = []
+    if len(ind_models) > 0:
+        ind_names = await rdb_handle.create_indexes(ind_models)
+        print("Created indexes: " + ", ".join(ind_names))
+
+    if drop:
+        for ind_name in ind_extra:
+            await rdb_handle.drop_index(ind_name)
+            print("Dropped index: " + ind_name)
+
+    rdb._indexes_verified.add(rdb._handle_key(rdb_handle))
+    return ind_names
+
+
+async def close_retronDB():
+    """
+    Close all pooled clients opened by ``connect_retronDB()`` in this module.
+
+    Returns
+    -------
+    None
+
+    """
+    while len(_clients) > 0:
+        _, client = _clients.popitem()
+        await client.close()
+
+
+###############################################################################
+# GET FUNCTIONS
+async def get_all_retrons(rdb_handle=None, format="df", fields=None,
+                          exclude=None, sort=None, limit=None, after=None):
+    """
+    Returns all fields (columns) for all retrons (rows). See
+    ``retrondb.get_all_retrons()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    format : ``str``, optional
+        Either "raw", "json", "dict", or "df" (default)
+    fields, exclude, sort, limit, after : optional
+        Projection, sort order and keyset pagination. See
+        ``retrondb.get_retrons_by()``.
+
+    Returns
+    -------
+    str, dict, pandas.DataFrame, or AsyncCursor obj
+        Retron properties as JSON (str), dictionary, DataFrame, or Cursor
+        depending on specified format
+
+    """
+    return await get_retrons_by(rdb_handle, None, None, format, fields,
+                                exclude, sort, limit, after)
+
+
+async def get_retron(rdb_handle=None, node=None, format="df", fields=None,
+                     exclude=None):
+    """
+    Returns a single retron. See ``retrondb.get_retron()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    node : ``str`` or int(automatically coverted to str)
+        Unique retron node ID
+    format : ``str``, optional
+        Either "raw", "json", "dict", or "df" (default)
+    fields, exclude : optional
+        Properties to return or leave out. See ``retrondb.get_retron()``.
+
+    Returns
+    -------
+    str, dict, or pandas.DataFrame
+        Retron properties as JSON (str), dictionary or DataFrame depending on
+        specified format
+
+    """
+    res = await rdb_handle.find_one(**rdb._find_args({"node":str(node)},
+                                                     fields, exclude))
+    return rdb.format_result(res, format)
+
+
+async def get_retrons_by(rdb_handle=None, key="node", value=None, format="df",
+                         fields=None, exclude=None, sort=None, limit=None,
+                         after=None):
+    """
+    Returns one or more retrons by a particular **key** and **value**. See
+    ``retrondb.get_retrons_by()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    key : ``str``, optional
+        Property key or name, e.g., "genus". If ``None``, all retrons are
+        returned.
+    value : ``str``, ``int``, ``float`` or ``set``
+        Propery value, e.g., "Escherichia" or set of conditions, e.g., {"$gt":5}
+    format : ``str``, optional
+        Either "raw", "json", "dict", or "df" (default)
+    fields, exclude, sort, limit, after : optional
+        Projection, sort order and keyset pagination. See
+        ``retrondb.get_retrons_by()``.
+
+    Returns
+    -------
+    str, dict, pandas.DataFrame, or AsyncCursor obj
+        Retron properties as JSON (str), dictionary, DataFrame, or Cursor
+        depending on specified format
+
+    """
+    if isinstance(value, list):
+        raise TypeError ("Sorry, more than one value is not supported." +
+                         " Consider using the set syntax with comparison" +
+                         " operators.")
+
+    if key == "node" and isinstance(value, int):
+        value = str(value)
+    value = rdb._coerce_query_value(key, value)
+
+    rdb_filter = {} if key is None else {str(key):value}
+    if format.lower() == "raw":
+        return rdb_handle.find(**rdb._find_args(rdb_filter, fields, exclude,
+                                                sort, limit, after))
+    res = [b async for b in iter_retrons(rdb_handle, rdb_filter,
+                                         format=format, fields=fields,
+                                         exclude=exclude, sort=sort,
+                                         limit=limit, after=after)]
+    return rdb._collect_batches(res, format)
+
+
+async def iter_retrons(rdb_handle=None, filter=None, batch_size=1000,
+                       format="df", fields=None, exclude=None, sort=None,
+                       limit=None, after=None):
+    """
+    Asynchronously iterate over retrons in batches from a single cursor. See
+    ``retrondb.iter_retrons()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    filter : ``dict``, optional
+        A MongoDB query filter. Default is all retrons.
+    batch_size : ``int``, optional
+        Maximum number of retrons per batch. Default is 1000.
+    format : ``str``, optional
+        Either "json", "dict", or "df" (default)
+    fields, exclude, sort, limit, after : optional
+        Projection, sort order and keyset pagination. See
+        ``retrondb.get_retrons_by()``.
+
+    Yields
+    ------
+    str, list of dict, or pandas.DataFrame
+        A batch of retron properties as JSON (str), dictionaries or DataFrame
+        depending on specified format
+
+    """
+    format = format.lower()
+    if format not in ["json","dict","df"]:
+        raise ValueError ('format must be "json", "dict" or "df"')
+
+    res = rdb_handle.find(batch_size=batch_size,
+                          **rdb._find_args(filter, fields, exclude, sort,
+                                           limit, after))
+    while True:
+        batch = await res.to_list(batch_size)
+        if len(batch) == 0:
+            return
+        yield rdb.format_result(batch, format)
+
+
+###############################################################################
+# ADD FUNCTIONS
+async def add_retron(rdb_handle=None, retron_dict=None, new_property=False):
+    """
+    Add a single retron given a dictionary. See ``retrondb.add_retron()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    retron_dict : ``dict``
+        A dictionary with retron data
+    new_property : ``bool``, optional
+        Whether to accept novel properties. Default is ``False``.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame of added retron properties.
+
+    """
+    radd_props = set(retron_dict.keys())
+    if "node" not in radd_props:
+        raise MissingKeyError()
+    retron_dict['node'] = str(retron_dict['node'])
+
+    await check_new_property(rdb_handle, radd_props, new_property)
+    retron_dict = rdb._apply_schema_dict(retron_dict)
+
+    try:
+        radd_obj = await rdb_handle.insert_one(retron_dict)
+    except pm.errors.DuplicateKeyError:
+        print(ansiRed.format("DuplicateKeyError")+": \"" +
+          retron_dict['node'] + "\" A retron with this" +
+              " same node ID already exists in the database. Either" +
+              " change the node ID"+
+              " or consider using update_retron().")
+    except Exception as e:
+        print(ansiRed.format("Error")+": Failed to add retron.\n", e)
+    else:
+        await _after_write(rdb_handle, [retron_dict['node']],
+                           radd_props | {"_id"})
+        print("Added retron to the database.")
+        radd_res = await rdb_handle.find_one({"_id":radd_obj.inserted_id})
+        return rdb.format_result(radd_res)
+
+
+###############################################################################
+# UPDATE FUNCTIONS
+async def update_retron(rdb_handle=None, retron_dict=None, new_property=False):
+    """
+    Update an existing retron given a dictionary. See
+    ``retrondb.update_retron()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    retron_dict : ``dict``
+        A dictionary with retron data
+    new_property : ``bool``, optional
+        Whether to accept novel properties. Default is ``False``.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame of updated retron properties.
+
+    """
+    rupd_props = set(retron_dict.keys())
+    if "node" not in rupd_props:
+        raise MissingKeyError()
+    retron_dict['node'] = str(retron_dict['node'])
+
+    await check_new_property(rdb_handle, rupd_props, new_property)
+    retron_dict = rdb._apply_schema_dict(retron_dict)
+
+    rupd_node = retron_dict['node']
+    try:
+        await rdb_handle.update_one({"node":rupd_node},{"$set":retron_dict})
+    except Exception as e:
+        print(ansiRed.format("Error")+": Failed to update retron.\n", e)
+    else:
+        await _after_write(rdb_handle, [rupd_node], rupd_props)
+        print("Updated retron in the database.")
+        return await get_retrons_by(rdb_handle, "node", {"$eq":rupd_node})
+
+
+###############################################################################
+# REMOVE FUNCTIONS
+async def remove_retron(rdb_handle=None, node=None):
+    """
+    IMPORTANT: This action will delete a retron and all of its properties from
+    the database!
+
+    Remove a retron given its node identifier. See
+    ``retrondb.remove_retron()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    node : ``str`` or ``int`` (automatically converted to ``str``)
+        A single retron node ID
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame of removed retron properties. The removal ID for
+        ``retrondb.restore_removed()`` is in ``attrs['removal']``.
+
+    """
+    if isinstance(node, list):
+        raise TypeError ("\"node\" should be a single string. Make a loop if" +
+                         " you have a list, or consider using " +
+                         " remove_retrons_by() with the set syntax.")
+
+    gone = await _remove_retrons(rdb_handle, {"node":str(node)})
+    print("Removed a retron from the database.")
+    return gone
+
+
+async def remove_retrons_by(rdb_handle=None, key="node", value=None,
+                            batch_size=1000):
+    """
+    IMPORTANT: This action will delete retrons and all of their properties from
+    the database!
+
+    Remove one or more retrons by a particular **key** and **value**. See
+    ``retrondb.remove_retrons_by()``.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    key : ``str``, optional
+        Property key or name, e.g., "genus"
+    value : ``str``, ``int``, ``float`` or ``set``
+        Propery value, e.g., "Escherichia" or set of conditions, e.g., {"$gt":5}
+    batch_size : ``int``, optional
+        Number of retrons archived and deleted at a time. Default is 1000.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame of removed retrons and their properties. The removal ID
+        for ``retrondb.restore_removed()`` is in ``attrs['removal']``.
+
+    """
+    if isinstance(value, list):
+        raise TypeError ("Sorry, more than one value is not supported." +
+                         " Consider using the set syntax with comparison" +
+                         " operators.")
+
+    if key == "node" and isinstance(value, int):
+        value = str(value)
+
+    value = rdb._coerce_query_value(key, value)
+
+    gone = await _remove_retrons(rdb_handle, {str(key):value}, batch_size)
+    print("Removed retrons from the database.")
+    return gone
+
+
+###############################################################################
+# INTERNAL FUNCTIONS
+async def check_new_property(rdb_handle=None, props=None, new_property=False):
+    """
+    Check incoming properties against existing properties in retron database.
+    See ``retrondb.check_new_property()``. Shares the property cache of the
+    retrondb module.
+
+    Parameters
+    ----------
+    rdb_handle : ``AsyncCollection`` obj
+        A retron database collection object, e.g., the output of
+        ``connect_retronDB()``
+    props : ``set``
+        Incoming property names
+    new_property : ``bool``, optional
+        Whether to accept novel properties. Default is ``False``.
+
+    Returns
+    -------
+    None
+
+    """
+    rdb_key = rdb._handle_key(rdb_handle)
+    if rdb_key not in rdb._property_catalog:
+        res = await rdb_handle.aggregate(rdb._properties_pipeline())
+        rdb._property_catalog[rdb_key] = set(
+            p['_id'] for p in await res.to_list(None))
+    radd_new = props.difference(rdb._property_catalog[rdb_key])
+    if len(radd_new) > 0 and not new_property:
+        raise UnrecognizedPropertyError(radd_new)
+
+
+async def _remove_retrons(rdb_handle=None, rdb_filter=None, batch_size=1000):
+    """
+    Archive the retrons matching a filter in the trash collection and delete
+    them. See ``retrondb._remove_retrons()``. Returns the removed retrons as
+    a DataFrame, with the removal ID in ``attrs['removal']``.
+    """
+    rdb_trash = await _trash_handle(rdb_handle)
+    removal = bson.ObjectId()
+    removed = datetime.datetime.now(datetime.timezone.utc)
+    async def archive_and_delete(session=None):
+        # Read in the transaction, so the trash holds what is deleted
+        res = rdb_handle.find(rdb_filter, limit=batch_size, session=session)
+        batch = await res.to_list(None)
+        if len(batch) > 0:
+            await rdb_trash.insert_many(rdb._trash_entries(batch, removal, 
+                                                           removed),
+                                        session=session)
+            await rdb_handle.delete_many(
+                {"_id":{"$in":[r['_id'] for r in batch]}}, session=session)
+        return batch
+
+    gone = []
+    while True:
+        batch = await _in_transaction(rdb_handle, archive_and_delete)
+        gone.extend(batch)
+        if len(batch) > 0:
+            await _after_write(rdb_handle, [r['node'] for r in batch 
+                                            if 'node' in r], deleted=True)
+        if len(batch) < batch_size:
+            break
+    gone = rdb.format_result(gone, "df")
+    gone.attrs['removal'] = str(removal)
+    return gone
+
+
+async def _in_transaction(rdb_handle=None, fn=None):
+    """
+    Await **fn(session)** in a transaction, or **fn(None)** if the server 
+    does not support transactions. See ``retrondb._in_transaction()``.
+    """
+    session = rdb_handle.database.client.start_session()
+    if asyncio.iscoroutine(session):
+        # A coroutine in earlier pymongo versions
+        session = await session
+    try:
+        async with session:
+            return await session.with_transaction(fn)
+    except pm.errors.OperationFailure as e:
+        # IllegalOperation: transactions need a replica set or mongos
+        if e.code != 20:
+            raise
+    return await fn(None)
+
+
+async def _after_write(rdb_handle=None, nodes=None, props=None,
+                       deleted=False):
+    """
+    Bookkeeping after retrons are added, updated or removed: keeps the
+    property catalog, query cache, change log and k-mer index current. See
+    ``retrondb._after_write()``.
+    """
+    ncrna_changed = rdb._note_write(rdb_handle, props, deleted)
+    if not nodes:
+        return
+    rdb_log = await _changes_handle(rdb_handle)
+    await rdb_log.bulk_write(rdb._change_log_ops(nodes, deleted), 
+                             ordered=False)
+
+    # Keep a k-mer index current, if any
+    rdb_key = rdb._handle_key(rdb_handle)
+    rdb_kmers = rdb_handle.database[rdb_handle.name + rdb.KMERS_SUFFIX]
+    found, k = rdb._cached_kmer_k(rdb_key)
+    if not found:
+        kmer_meta = await rdb_kmers.find_one({"_id":"_meta"})
+        k = None if kmer_meta is None else kmer_meta['k']
+        rdb._kmer_k[rdb_key] = (k, time.monotonic())
+    if k is None or not ncrna_changed:
+        return
+    nodes = [str(n) for n in set(nodes)]
+    if deleted:
+        await rdb_kmers.delete_many({"_id":{"$in":nodes}})
+        return
+    res = rdb_handle.find({"node":{"$in":nodes}}, {"_id":0, "node":1, "ncrna":1})
+    seqs = {r['node']:r.get('ncrna') for r in await res.to_list(None)}
+    await rdb_kmers.bulk_write(rdb._kmer_ops(nodes, seqs, k), ordered=False)
+
+
+async def _changes_handle(rdb_handle=None):
+    """
+    The change log collection of a retron database. See 
+    ``retrondb._changes_handle()``.
+    """
+    rdb_log = rdb_handle.database[rdb_handle.name + rdb.CHANGES_SUFFIX]
+    if rdb._handle_key(rdb_log) not in rdb._changes_indexed:
+        await rdb_log.create_indexes(
+            rdb._index_plan(rdb.CHANGES_INDEX_SPEC)[0])
+        rdb._changes_indexed.add(rdb._handle_key(rdb_log))
+    return rdb_log
+
+
+async def _trash_handle(rdb_handle=None):
+    """
+    The trash collection of a retron database. See 
+    ``retrondb._trash_handle()``.
+    """
+    rdb_trash = rdb_handle.database[rdb_handle.name + rdb.TRASH_SUFFIX]
+    if rdb._handle_key(rdb_trash) not in rdb._trash_indexed:
+        await rdb_trash.create_indexes(
+            rdb._index_plan(rdb.TRASH_INDEX_SPEC)[0])
+        rdb._trash_indexed.add(rdb._handle_key(rdb_trash))
+    return rdb_trash
@@ -0,0 +1,674 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The retrondb_local module of an in-process stand-in for a MongoDB server,
+for working with retron databases offline, e.g., for tests or for bulk
+analytics without network round trips.
+
+``retrondb.connect_retronDB(db_name, uri="local")`` returns a
+``LocalCollection`` that the retrondb functions accept as **rdb_handle**. It
+implements the part of the ``pymongo.Collection`` API that they use: finds
+with query operators, projections, sorting and limits; inserts, updates
+($set, $unset, $inc, $setOnInsert and $currentDate), replacements, deletes
+and bulk writes; and indexes, with unique ones like "node" enforced.
+Aggregations are not supported, so ``summarize_retrons()``,
+``search_sequence()``, ``explain_query()`` and ``migrate_property_types()``
+still need a MongoDB server.
+
+Data is kept in memory for the life of the process. Use
+``retrondb.sync_retronDB()`` to copy a database from or to a server.
+
+Usage: dbl = rdb.connect_retronDB("sandbox", uri="local")
+
+Created on Thu Oct 15 14:00:00 2026
+@author: alexpico
+"""
+
+import pymongo as pm
+import bson
+import copy
+import datetime
+import re
+import threading
+
+#CACHES
+# Local databases of the process, by name, shared by all LocalClients
+_databases = {}
+_databases_lock = threading.Lock()
+
+# Missing field, distinct from a null value
+_MISSING = object()
+
+# Order of BSON types when sorting and comparing values of different types
+_TYPE_ORDER = [(type(None), 1), (bool, 8), ((int, float), 2), (str, 3),
+               (dict, 4), (list, 5), (bytes, 6), (bson.ObjectId, 7),
+               (datetime.datetime, 9)]
+
+# Names for the $type query operator
+_TYPE_NAMES = {"double":float, "string":str, "object":dict, "array":list,
+               "binData":bytes, "objectId":bson.ObjectId, "bool":bool,
+               "date":datetime.datetime, "null":type(None), "int":int,
+               "long":int, "number":(int, float)}
+
+
+###############################################################################
+# CLASSES
+class LocalClient:
+    '''Stand-in for a pymongo.MongoClient holding local databases'''
+    def __getitem__(self, db_name):
+        with _databases_lock:
+            if db_name not in _databases:
+                _databases[db_name] = LocalDatabase(self, db_name)
+            return _databases[db_name]
+
+    def get_database(self, db_name):
+        return self[db_name]
+
+    def list_database_names(self):
+        return [n for n, db in _databases.items()
+                if db.list_collection_names()]
+
+    def drop_database(self, db_name):
+        if hasattr(db_name, "name"):
+            db_name = db_name.name
+        if db_name in _databases:
+            for coll in list(_databases[db_name]._collections.values()):
+                coll.drop()
+
+    def close(self):
+        pass
+
+
+class LocalDatabase:
+    '''Stand-in for a pymongo.Database holding local collections'''
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, coll_name):
+        with self._lock:
+            if coll_name not in self._collections:
+                self._collections[coll_name] = LocalCollection(self,
+                                                               coll_name)
+            return self._collections[coll_name]
+
+    def get_collection(self, coll_name):
+        return self[coll_name]
+
+    def list_collection_names(self):
+        return [n for n, c in self._collections.items()
+                if c._docs or len(c._indexes) > 1]
+
+    def drop_collection(self, coll_name):
+        if hasattr(coll_name, "name"):
+            coll_name = coll_name.name
+        if coll_name in self._collections:
+            self._collections[coll_name].drop()
+
+    def command(self, command, *args, **kwargs):
+        raise NotImplementedError("Database commands are not supported by" +
+                                  " the local backend.")
+
+
+class LocalCollection:
+    '''Stand-in for a pymongo.Collection of documents kept in memory.
+    The full_name is prefixed with "local:" so the in-process caches of the
+    retrondb module do not mix it up with a server collection.'''
+    is_local = True
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = "local:" + database.name + "." + name
+        self._docs = {}
+        self._indexes = {"_id_":{"v":2, "key":bson.SON([("_id", 1)]),
+                                 "name":"_id_"}}
+        self._unique = {}
+        self._lock = threading.RLock()
+
+    # Reads
+    def find(self, filter=None, projection=None, sort=None, limit=0,
+             skip=0, batch_size=0, **kwargs):
+        with self._lock:
+            docs = [d for d in self._candidates(filter) if _match(d, filter)]
+            if sort is not None:
+                docs = _sort(docs, sort)
+            docs = docs[skip:]
+            if limit:
+                docs = docs[:limit]
+            docs = [_project(d, projection) for d in docs]
+        return iter(docs)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id":filter}
+        return next(self.find(filter, projection, sort, limit=1), None)
+
+    def count_documents(self, filter=None, **kwargs):
+        with self._lock:
+            return sum(1 for d in self._candidates(filter) 
+                       if _match(d, filter))
+
+    def estimated_document_count(self, **kwargs):
+        return len(self._docs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        vals = []
+        for d in self.find(filter):
+            v = _get(d, key)
+            for v in (v if isinstance(v, list) else [v]):
+                if v is not _MISSING and v not in vals:
+                    vals.append(v)
+        return vals
+
+    def property_names(self):
+        with self._lock:
+            return set(k for d in self._docs.values() for k in d)
+
+    def aggregate(self, pipeline, **kwargs):
+        raise NotImplementedError("Aggregations are not supported by the " +
+                                  "local backend.")
+
+    # Writes
+    def insert_one(self, document, **kwargs):
+        with self._lock:
+            self._insert(document)
+        return pm.results.InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        documents = list(documents)
+        self.bulk_write([pm.InsertOne(d) for d in documents], ordered)
+        return pm.results.InsertManyResult([d['_id'] for d in documents],
+                                           True)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            n, n_mod, up_id = self._update(filter, update, upsert, False)
+        return pm.results.UpdateResult(_raw_result(n, n_mod, up_id), True)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            n, n_mod, up_id = self._update(filter, update, upsert, True)
+        return pm.results.UpdateResult(_raw_result(n, n_mod, up_id), True)
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        with self._lock:
+            n, n_mod, up_id = self._update(filter, replacement, upsert,
+                                           False, replace=True)
+        return pm.results.UpdateResult(_raw_result(n, n_mod, up_id), True)
+
+    def delete_one(self, filter, **kwargs):
+        with self._lock:
+            n = self._delete(filter, False)
+        return pm.results.DeleteResult({"n":n, "ok":1.0}, True)
+
+    def delete_many(self, filter, **kwargs):
+        with self._lock:
+            n = self._delete(filter, True)
+        return pm.results.DeleteResult({"n":n, "ok":1.0}, True)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        result = {"writeErrors":[], "writeConcernErrors":[], "nInserted":0,
+                  "nUpserted":0, "nMatched":0, "nModified":0, "nRemoved":0,
+                  "upserted":[]}
+        with self._lock:
+            for i, op in enumerate(requests):
+                op_name = type(op).__name__
+                try:
+                    if op_name == "InsertOne":
+                        self._insert(op._doc)
+                        result['nInserted'] += 1
+                    elif op_name in ["UpdateOne", "UpdateMany", "ReplaceOne"]:
+                        n, n_mod, up_id = self._update(
+                            op._filter, op._doc, op._upsert,
+                            op_name == "UpdateMany",
+                            replace=op_name == "ReplaceOne")
+                        result['nMatched'] += n
+                        result['nModified'] += n_mod
+                        if up_id is not None:
+                            result['nUpserted'] += 1
+                            result['upserted'].append({"index":i,
+                                                       "_id":up_id})
+                    elif op_name in ["DeleteOne", "DeleteMany"]:
+                        result['nRemoved'] += self._delete(
+                            op._filter, op_name == "DeleteMany")
+                    else:
+                        raise NotImplementedError(op_name + " is not " +
+                                                  "supported by the local " +
+                                                  "backend.")
+                except pm.errors.DuplicateKeyError as e:
+                    result['writeErrors'].append({"index":i, "code":e.code,
+                                                  "errmsg":str(e),
+                                                  "op":getattr(op, "_doc",
+                                                               None)})
+                    if ordered:
+                        break
+        if result['writeErrors']:
+            raise pm.errors.BulkWriteError(result)
+        return pm.results.BulkWriteResult(result, True)
+
+    def drop(self, **kwargs):
+        # Emptied rather than removed, so existing handles stay usable
+        with self._lock:
+            self._docs.clear()
+            for name in list(self._indexes):
+                if name != "_id_":
+                    self.drop_index(name)
+
+    # Indexes
+    def create_index(self, keys, **kwargs):
+        return self.create_indexes([pm.IndexModel(keys, **kwargs)])[0]
+
+    def create_indexes(self, indexes, **kwargs):
+        names = []
+        with self._lock:
+            for model in indexes:
+                ind = dict(model.document)
+                ind['key'] = bson.SON(ind['key'])
+                if ind['name'] not in self._indexes:
+                    if ind.get('unique'):
+                        self._unique[ind['name']] = self._unique_keys(ind)
+                    self._indexes[ind['name']] = {"v":2, **ind}
+                names.append(ind['name'])
+        return names
+
+    def list_indexes(self, **kwargs):
+        with self._lock:
+            return iter([copy.deepcopy(ind)
+                         for ind in self._indexes.values()])
+
+    def index_information(self):
+        return {ind['name']:{"key":list(ind['key'].items()),
+                             **{o:v for o, v in ind.items()
+                                if o not in ["key", "name"]}}
+                for ind in self.list_indexes()}
+
+    def drop_index(self, index_or_name):
+        with self._lock:
+            self._indexes.pop(index_or_name, None)
+            self._unique.pop(index_or_name, None)
+
+    # Internals, called with the lock held
+    def _candidates(self, filter):
+        # Documents that may match, looked up by _id or a unique index for
+        # equality and $in conditions, else all of them
+        for key, cond in (filter or {}).items():
+            if isinstance(cond, dict) and list(cond) == ["$eq"]:
+                vals = [cond['$eq']]
+            elif isinstance(cond, dict) and list(cond) == ["$in"]:
+                vals = cond['$in']
+            elif isinstance(cond, dict) or isinstance(cond, re.Pattern) or \
+                key.startswith("$"):
+                continue
+            else:
+                vals = [cond]
+            if key == "_id":
+                return [self._docs[v] for v in vals 
+                        if _hashable(v) in self._docs]
+            for name, keys in self._unique.items():
+                ind = self._indexes[name]
+                if list(ind['key']) == [key] and \
+                    "partialFilterExpression" not in ind and \
+                    not any(isinstance(v, (list, re.Pattern)) or v is None 
+                            for v in vals):
+                    ids = [keys.get((_hashable(v),)) for v in vals]
+                    return [self._docs[i] for i in dict.fromkeys(ids) 
+                            if i is not None]
+        return list(self._docs.values())
+
+    def _insert(self, document):
+        if '_id' not in document:
+            document['_id'] = bson.ObjectId()
+        doc = copy.deepcopy(document)
+        if doc['_id'] in self._docs:
+            raise _duplicate_key_error("_id_", doc['_id'])
+        self._index_doc(doc)
+        self._docs[doc['_id']] = doc
+
+    def _update(self, filter, update, upsert, multi, replace=False):
+        if isinstance(update, list):
+            raise NotImplementedError("Aggregation pipeline updates are " +
+                                      "not supported by the local backend.")
+        matched = [d for d in self._candidates(filter) if _match(d, filter)]
+        if not multi:
+            matched = matched[:1]
+        n_mod = 0
+        for old in matched:
+            new = copy.deepcopy(old)
+            if replace:
+                new = {"_id":old['_id'], **copy.deepcopy(update)}
+            else:
+                _apply_update(new, update, False)
+            if new != old:
+                self._unindex_doc(old)
+                try:
+                    self._index_doc(new)
+                except pm.errors.DuplicateKeyError:
+                    self._index_doc(old)
+                    raise
+                self._docs[old['_id']] = new
+                n_mod += 1
+        if matched or not upsert:
+            return len(matched), n_mod, None
+
+        # Upsert: the equality conditions of the filter, then the update
+        new = {k:(v['$eq'] if isinstance(v, dict) and "$eq" in v else v)
+               for k, v in (filter or {}).items()
+               if not k.startswith("$") and not
+               (isinstance(v, dict) and any(o.startswith("$") and o != "$eq"
+                                            for o in v))}
+        if replace:
+            new = {**({"_id":new['_id']} if '_id' in new else {}),
+                   **copy.deepcopy(update)}
+        else:
+            _apply_update(new, update, True)
+        self._insert(new)
+        return 0, 0, new['_id']
+
+    def _delete(self, filter, multi):
+        matched = [d for d in self._candidates(filter) if _match(d, filter)]
+        if not multi:
+            matched = matched[:1]
+        for doc in matched:
+            self._unindex_doc(doc)
+            del self._docs[doc['_id']]
+        return len(matched)
+
+    def _unique_keys(self, ind):
+        keys = {}
+        for doc in self._docs.values():
+            key = _index_key(doc, ind)
+            if key is None:
+                continue
+            if key in keys:
+                raise _duplicate_key_error(ind['name'], key)
+            keys[key] = doc['_id']
+        return keys
+
+    def _index_doc(self, doc):
+        new_keys = []
+        for name, keys in self._unique.items():
+            key = _index_key(doc, self._indexes[name])
+            if key is None:
+                continue
+            if keys.get(key, doc['_id']) != doc['_id']:
+                raise _duplicate_key_error(name, key)
+            new_keys.append((keys, key))
+        for keys, key in new_keys:
+            keys[key] = doc['_id']
+
+    def _unindex_doc(self, doc):
+        for name, keys in self._unique.items():
+            key = _index_key(doc, self._indexes[name])
+            if key is not None and keys.get(key) == doc['_id']:
+                del keys[key]
+
+
+###############################################################################
+# INTERNAL FUNCTIONS
+def _raw_result(n=0, n_mod=0, up_id=None):
+    """
+    Server reply of an update, for ``pymongo.results.UpdateResult``.
+    """
+    res = {"n":n + (up_id is not None), "nModified":n_mod, "ok":1.0,
+           "updatedExisting":n > 0}
+    if up_id is not None:
+        res['upserted'] = up_id
+    return res
+
+
+def _duplicate_key_error(index_name=None, key=None):
+    """
+    The error a server raises when a unique index would be violated.
+    """
+    return pm.errors.DuplicateKeyError(
+        "E11000 duplicate key error index: " + str(index_name) +
+        " dup key: " + str(key), 11000)
+
+
+def _index_key(doc=None, ind=None):
+    """
+    Hashable key of a document in a unique index, or None if the document
+    is not covered by its partial filter.
+    """
+    if "partialFilterExpression" in ind and \
+        not _match(doc, ind['partialFilterExpression']):
+        return None
+    return tuple(_hashable(_get(doc, k)) for k in ind['key'])
+
+
+def _hashable(value=None):
+    """
+    A hashable equivalent of a value. Missing fields are indexed as null.
+    """
+    if value is _MISSING:
+        return None
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple((k, _hashable(v)) for k, v in value.items())
+    return value
+
+
+def _get(doc=None, path=None):
+    """
+    Value of a field, following "." into embedded documents. ``_MISSING`` if
+    it is not there.
+    """
+    for key in path.split("."):
+        if not isinstance(doc, dict) or key not in doc:
+            return _MISSING
+        doc = doc[key]
+    return doc
+
+
+def _set(doc=None, path=None, value=None):
+    """
+    Set a field, following "." into (new) embedded documents.
+    """
+    keys = path.split(".")
+    for key in keys[:-1]:
+        doc = doc.setdefault(key, {})
+    doc[keys[-1]] = value
+
+
+def _type_rank(value=None):
+    """
+    Rank of the BSON type of a value in sort order.
+    """
+    for types, rank in _TYPE_ORDER:
+        if isinstance(value, types):
+            return rank
+    return 10
+
+
+def _sort_key(value=None):
+    """
+    Sort key of a value: BSON type first, then the value. Missing fields
+    sort as null.
+    """
+    if value is _MISSING or value is None:
+        return (1, 0)
+    rank = _type_rank(value)
+    if rank in [4, 5]:
+        return (rank, str(value))
+    return (rank, value)
+
+
+def _sort(docs=None, sort=None):
+    """
+    Documents in the order of a sort specification, e.g.,
+    [("node", 1), ("modified", -1)].
+    """
+    if isinstance(sort, str):
+        sort = [(sort, 1)]
+    for key, direction in reversed(list(sort)):
+        docs = sorted(docs, key=lambda d: _sort_key(_get(d, key)),
+                      reverse=direction == -1)
+    return docs
+
+
+def _project(doc=None, projection=None):
+    """
+    A copy of a document with only the included, or without the excluded,
+    top-level fields.
+    """
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {p:1 for p in projection}
+    if any(v for k, v in projection.items() if k != "_id") or \
+        all(projection.values()):
+        out = {}
+        if projection.get("_id", 1) and "_id" in doc:
+            out['_id'] = doc['_id']
+        for k, v in projection.items():
+            if v and k != "_id" and _get(doc, k) is not _MISSING:
+                _set(out, k, copy.deepcopy(_get(doc, k)))
+        return out
+    return {k:copy.deepcopy(v) for k, v in doc.items()
+            if projection.get(k, 1)}
+
+
+def _eq(value=None, arg=None):
+    """
+    Whether a field matches a value, including array fields that contain it
+    and missing fields matching null.
+    """
+    if value is _MISSING:
+        return arg is None
+    if isinstance(value, list) and not isinstance(arg, list):
+        return any(_eq(v, arg) for v in value)
+    if isinstance(value, bool) != isinstance(arg, bool):
+        return False
+    return value == arg
+
+
+def _compare(value=None, arg=None, op=None):
+    """
+    Whether a field compares to a value with $gt, $gte, $lt or $lte. Values
+    of different BSON types do not match.
+    """
+    if value is _MISSING:
+        return False
+    if isinstance(value, list):
+        return any(_compare(v, arg, op) for v in value)
+    if _type_rank(value) != _type_rank(arg):
+        return False
+    try:
+        return {"$gt":value > arg, "$gte":value >= arg,
+                "$lt":value < arg, "$lte":value <= arg}[op]
+    except TypeError:
+        return False
+
+
+def _is_type(value=None, type_name=None):
+    """
+    Whether a field value is of a type named as for the $type operator. 
+    Booleans are not numbers.
+    """
+    if value is _MISSING:
+        return False
+    if isinstance(value, bool):
+        return type_name == "bool"
+    return isinstance(value, _TYPE_NAMES[type_name])
+
+
+def _match_cond(value=None, cond=None):
+    """
+    Whether a field value matches a condition: a value, a regular
+    expression, or a document of query operators.
+    """
+    if isinstance(cond, re.Pattern):
+        return isinstance(value, str) and cond.search(value) is not None
+    if not (isinstance(cond, dict) and cond and
+            all(k.startswith("$") for k in cond)):
+        return _eq(value, cond)
+    for op, arg in cond.items():
+        if op == "$eq":
+            ok = _eq(value, arg)
+        elif op == "$ne":
+            ok = not _eq(value, arg)
+        elif op in ["$gt", "$gte", "$lt", "$lte"]:
+            ok = _compare(value, arg, op)
+        elif op == "$in":
+            ok = any(_match_cond(value, a) for a in arg)
+        elif op == "$nin":
+            ok = not any(_match_cond(value, a) for a in arg)
+        elif op == "$exists":
+            ok = (value is not _MISSING) == bool(arg)
+        elif op == "$type":
+            types = [arg] if isinstance(arg, str) else arg
+            ok = any(_is_type(value, t) for t in types)
+        elif op == "$regex":
+            ok = isinstance(value, str) and re.search(
+                arg, value, re.I if "i" in cond.get("$options", "") else 0
+                ) is not None
+        elif op == "$options":
+            ok = True
+        elif op == "$not":
+            ok = not _match_cond(value, arg)
+        elif op == "$size":
+            ok = isinstance(value, list) and len(value) == arg
+        elif op == "$all":
+            ok = all(_eq(value, a) for a in arg)
+        else:
+            raise NotImplementedError("The " + op + " operator is not " +
+                                      "supported by the local backend.")
+        if not ok:
+            return False
+    return True
+
+
+def _match(doc=None, filter=None):
+    """
+    Whether a document matches a query filter.
+    """
+    for key, cond in (filter or {}).items():
+        if key == "$and":
+            ok = all(_match(doc, f) for f in cond)
+        elif key == "$or":
+            ok = any(_match(doc, f) for f in cond)
+        elif key == "$nor":
+            ok = not any(_match(doc, f) for f in cond)
+        else:
+            ok = _match_cond(_get(doc, key), cond)
+        if not ok:
+            return False
+    return True
+
+
+def _apply_update(doc=None, update=None, is_insert=False):
+    """
+    Apply the update operators of an update document to a document in
+    place.
+    """
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and is_insert):
+            for k, v in fields.items():
+                _set(doc, k, copy.deepcopy(v))
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$unset":
+            for k in fields:
+                keys = k.split(".")
+                parent = _get(doc, ".".join(keys[:-1])) if len(keys) > 1 \
+                    else doc
+                if isinstance(parent, dict):
+                    parent.pop(keys[-1], None)
+        elif op == "$inc":
+            for k, v in fields.items():
+                old = _get(doc, k)
+                _set(doc, k, v if old is _MISSING else old + v)
+        elif op == "$currentDate":
+            now = datetime.datetime.now(datetime.timezone.utc).replace(
+                tzinfo=None)
+            # Dates are stored to the millisecond, as by a server
+            now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+            for k in fields:
+                _set(doc, k, now)
+        else:
+            raise NotImplementedError("The " + op + " update operator is " +
+                                      "not supported by the local backend.")